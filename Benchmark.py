@@ -0,0 +1,358 @@
+"""
+
+Benchmark Script
+-----------------
+
+Measures how fast the simulator is, so that performance regressions are caught:
+python Benchmark.py [--quick] [--output results.json] [--baseline baseline.json] [--tolerance 0.2]
+
+There are six benchmarks:
+    medium  Medium.update (and listen, once per node per step) on a random lot
+            with random broadcasts, for each medium engine
+    mac     MultipleAccess.update for every node on a random lot, with
+            broadcasts queued at random (and VectorMultipleAccess.update)
+    full    tree construction plus aggregation (Experiment.Trial.run) with the
+            time step loop and with the event scheduler
+    grow    tree construction plus aggregation on GROW_TRIALS lots, with each node
+            commanding its children one at a time (serial) and concurrently
+            (concurrent_grow, see Node.command_separated_children), for the
+            protocol's completion time and collision rate
+    policy  the same, with each set of contention policies in
+            ContentionPolicy.POLICY_SETS, for the completion time, the ids
+            that reached the sink and the MAC's throughput and latency (see
+            ContentionPolicy.summarize)
+    quiet   the same on each lot layout in LAYOUTS, with the fixed GROW window
+            (grow_timeout) and with the adaptive one (grow_quiet_factor=QUIET_FACTOR,
+            see Node.quiet_period), for the reduction in the completion time and
+            the ids that reached the sink with each
+Each one is run over a range of lot sizes (10x10 up to 200x200), occupancies and
+radii. Every case runs in a fresh process, so that its peak memory can be measured.
+
+The results are written as JSON: one record per case, with its parameters, the
+number of steps, seconds, steps per second, peak memory (the process's maximum
+resident set size, in KB) and, for full runs, the time step at which the sink
+got the data (None if the trial was given up after MAX_STEPS; any other exception
+in a trial is a crash, and stops the benchmark). Grow runs have the mean of that
+over the lots that finished, and the collision rate: the receptions lost to
+collisions per packet sent (over all the lots). Quiet runs have the mean time and
+the fraction of the cars whose ids reached a sink for each GROW window, and the
+reduction in the time with the adaptive one. With --baseline, each case is
+compared with the same case in a saved results file, and the script exits with
+status 1 if its steps per second dropped by more than the tolerance.
+
+
+"""
+
+
+from Medium2 import Medium
+from MultipleAccess import MultipleAccess
+from Node import Node
+from Packet import Packet
+from Experiment import Trial
+from EventLog import TextEventLog
+from ContentionPolicy import POLICY_SETS, summarize
+from Topology import poisson_lot, multiple_lots
+from functools import partial
+from timeit import default_timer
+import multiprocessing
+import argparse
+import resource
+import platform
+import random
+import json
+import sys
+import os
+
+# the cases: benchmark -> parameters to sweep
+FULL_SIZES = {'medium':{'lot_size':[10,25,50,100,200],'occupancy':[.62],'radius':[2,4]},
+              'mac':{'lot_size':[10,25,50,100,200],'occupancy':[.62],'radius':[2]},
+              'full':{'lot_size':[10,25,50,100,200],'occupancy':[.62],'radius':[2,4]},
+              'grow':{'lot_size':[10,20],'occupancy':[.62],'radius':[2,4]},
+              'policy':{'lot_size':[10],'occupancy':[.62],'radius':[2,4]},
+              'quiet':{'lot_size':[10,20],'occupancy':[.62],'radius':[2]}}
+QUICK_SIZES = {'medium':{'lot_size':[10,50],'occupancy':[.62],'radius':[2]},
+               'mac':{'lot_size':[10,50],'occupancy':[.62],'radius':[2]},
+               'full':{'lot_size':[10],'occupancy':[.62],'radius':[2]},
+               'grow':{'lot_size':[10],'occupancy':[.62],'radius':[2]},
+               'policy':{'lot_size':[10],'occupancy':[.62],'radius':[2]},
+               'quiet':{'lot_size':[10],'occupancy':[.62],'radius':[2]}}
+
+STEPS = 200             # time steps per medium/mac case
+LOAD = 0.001            # the chance that a node sends a broadcast in a time step (medium/mac cases)
+MAX_STEPS = 1000000     # give up on a full run after this many time steps
+GROW_TRIALS = 5         # the lots per grow, policy or quiet case (seeds SEED, SEED + 1, ...)
+QUIET_FACTOR = 2        # the grow_quiet_factor of the quiet cases
+SEED = 0
+
+
+def create_lot(lot_size,occupancy,radius):
+    # the nodes of a random lot (without a sink or an event log)
+    nodes = []
+    for i in range(0,lot_size):
+        for j in range(0,lot_size):
+            if random.random() <= occupancy:
+                node = Node(i,j,i * lot_size + j,str(i) + '_' + str(j))
+                node.radius = radius
+                nodes.append(node)
+    return nodes
+
+
+def create_medium(engine):
+    if engine == 'VectorMedium':
+        from VectorMedium import VectorMedium
+        return VectorMedium()
+    return Medium()
+
+
+def bench_medium(engine,lot_size,occupancy,radius):
+    random.seed(SEED)
+    nodes = create_lot(lot_size,occupancy,radius)
+    medium = create_medium(engine)
+    medium.connect_to_the_nodes(nodes)
+    update_seconds = 0.0
+    listen_seconds = 0.0
+    for step in range(STEPS):
+        for node in nodes:
+            if random.random() < LOAD:
+                medium.propagate(Packet(node.id,(),'benchmark','broadcast'))
+        start = default_timer()
+        medium.update()
+        update_seconds += default_timer() - start
+        start = default_timer()
+        for node in nodes:
+            medium.listen(node.id)
+        listen_seconds += default_timer() - start
+    return {'nodes':len(nodes),'steps':STEPS,'seconds':update_seconds + listen_seconds,
+            'update_seconds':update_seconds,'listen_seconds':listen_seconds}
+
+
+def bench_mac(engine_name,lot_size,occupancy,radius):
+    random.seed(SEED)
+    nodes = create_lot(lot_size,occupancy,radius)
+    medium = Medium()
+    medium.connect_to_the_nodes(nodes)
+    engine = None
+    if engine_name == 'VectorMultipleAccess':
+        from VectorMultipleAccess import VectorMultipleAccess
+        engine = VectorMultipleAccess(nodes)
+    interfaces = []
+    for node in nodes:
+        node.connect_to_the_medium(medium)
+        interfaces.append(node.network_interface)
+    if engine:
+        engine.connect_to_the_medium(medium)
+    seconds = 0.0
+    for step in range(STEPS):
+        for interface in interfaces:
+            if random.random() < LOAD:
+                interface.send_message(Packet(interface._node_id,(),'benchmark','broadcast'))
+        start = default_timer()
+        for interface in interfaces:
+            interface.update()
+        if engine:
+            engine.update()
+        seconds += default_timer() - start
+        medium.update()
+    return {'nodes':len(nodes),'steps':STEPS,'seconds':seconds}
+
+
+def benchmark_trial(seed,occupancy,radius,lot_size,use_event_scheduler=True,**options):
+    # a trial whose events are written to nowhere (an EventLog can't flush)
+    return Trial(TextEventLog(os.devnull),use_event_scheduler=use_event_scheduler,seed=seed,occupancy=occupancy,
+                 radius=radius,lot_size=lot_size,**options)
+
+
+def run_to_sink(trial):
+    # run a trial until the sink has the data, and return its time (None if it was given up
+    # after MAX_STEPS). Any other exception is a crash, and is raised.
+    try:
+        return trial.run(max_steps=MAX_STEPS)
+    except Exception:
+        if trial.finished or trial.time < MAX_STEPS:
+            raise
+        return None
+    finally:
+        trial.event_log.close()
+
+
+def bench_full(engine,lot_size,occupancy,radius):
+    start = default_timer()
+    trial = benchmark_trial(SEED,occupancy,radius,lot_size,use_event_scheduler=(engine == 'event scheduler'))
+    time_to_sink = run_to_sink(trial)
+    return {'steps':trial.time,'seconds':default_timer() - start,'time_to_sink':time_to_sink}
+
+
+def bench_grow(engine,lot_size,occupancy,radius):
+    steps = 0
+    times = []
+    collisions = 0
+    signals = 0
+    start = default_timer()
+    for seed in range(SEED,SEED + GROW_TRIALS):
+        trial = benchmark_trial(seed,occupancy,radius,lot_size,concurrent_grow=(engine == 'concurrent'))
+        time = run_to_sink(trial)
+        steps += trial.time
+        if time is not None:
+            times.append(time)
+        collisions += trial.medium.collision_count
+        signals += trial.medium.signal_id_counter
+    return {'steps':steps,'seconds':default_timer() - start,'trials':GROW_TRIALS,'finished':len(times),
+            'time_to_sink':sum(times) / float(len(times)) if times else None,
+            'collision_rate':collisions / float(signals) if signals else None}
+
+
+def bench_policy(engine,lot_size,occupancy,radius):
+    steps = 0
+    times = []
+    coverage = []
+    totals = {'delivered':0,'delivery_ticks':0.0,'retransmissions':0,'ack_timeouts':0}
+    start = default_timer()
+    for seed in range(SEED,SEED + GROW_TRIALS):
+        trial = benchmark_trial(seed,occupancy,radius,lot_size,policies=POLICY_SETS[engine])
+        time = run_to_sink(trial)
+        steps += trial.time
+        if time is not None:
+            times.append(time)
+        summary = summarize(trial.node_stats(),trial.time)
+        if trial.topology.node_count():
+            coverage.append(trial.ids_received() / float(trial.topology.node_count()))
+        totals['delivered'] += summary['delivered']
+        totals['delivery_ticks'] += (summary['latency'] or 0) * summary['delivered']
+        totals['retransmissions'] += summary['retransmissions']
+        totals['ack_timeouts'] += summary['ack_timeouts']
+    return {'steps':steps,'seconds':default_timer() - start,'trials':GROW_TRIALS,'finished':len(times),
+            'time_to_sink':sum(times) / float(len(times)) if times else None,
+            'coverage':sum(coverage) / len(coverage) if coverage else None,
+            'throughput':totals['delivered'] / float(steps) if steps else None,
+            'latency':totals['delivery_ticks'] / totals['delivered'] if totals['delivered'] else None,
+            'retransmissions':totals['retransmissions'],
+            'ack_timeouts':totals['ack_timeouts']}
+
+
+def layout(name,lot_size,occupancy):
+    # the topology argument of a Trial for a lot layout: a lot_size x lot_size grid lot, the
+    # same area with a Poisson number of cars per space, or two grid lots, each with its sink
+    if name == 'grid':
+        return None
+    elif name == 'poisson':
+        return partial(poisson_lot,width=lot_size,height=lot_size,density=occupancy)
+    elif name == 'multiple lots':
+        return partial(multiple_lots,lots=2,lot_size=lot_size,occupancy=occupancy)
+    raise Exception('unknown layout: ' + name)
+
+LAYOUTS = ['grid','poisson','multiple lots']
+
+
+def bench_quiet(engine,lot_size,occupancy,radius):
+    steps = 0
+    results = {}
+    start = default_timer()
+    for (mode,factor) in [('fixed',None),('adaptive',QUIET_FACTOR)]:
+        times = []
+        received = 0
+        cars = 0
+        for seed in range(SEED,SEED + GROW_TRIALS):
+            trial = benchmark_trial(seed,occupancy,radius,lot_size,topology=layout(engine,lot_size,occupancy),
+                                    grow_quiet_factor=factor)
+            time = run_to_sink(trial)
+            steps += trial.time
+            if time is not None:
+                times.append(time)
+            received += trial.ids_received()
+            cars += trial.topology.node_count()
+        results[mode] = {'finished':len(times),
+                         'time_to_sink':sum(times) / float(len(times)) if times else None,
+                         'coverage':received / float(cars) if cars else None}
+    (fixed,adaptive) = (results['fixed']['time_to_sink'],results['adaptive']['time_to_sink'])
+    return {'steps':steps,'seconds':default_timer() - start,'trials':GROW_TRIALS,'quiet_factor':QUIET_FACTOR,
+            'fixed':results['fixed'],'adaptive':results['adaptive'],
+            'reduction':1 - adaptive / fixed if fixed and adaptive else None}
+
+
+BENCHMARKS = {'medium':(bench_medium,['Medium2','VectorMedium']),
+              'mac':(bench_mac,['MultipleAccess','VectorMultipleAccess']),
+              'full':(bench_full,['tick loop','event scheduler']),
+              'grow':(bench_grow,['serial','concurrent']),
+              'policy':(bench_policy,sorted(POLICY_SETS.keys())),
+              'quiet':(bench_quiet,LAYOUTS)}
+
+
+def run_case(case):
+    # run one case (in a fresh worker process) and return its record
+    (benchmark,engine,lot_size,occupancy,radius) = case
+    record = {'benchmark':benchmark,'engine':engine,'lot_size':lot_size,'occupancy':occupancy,'radius':radius}
+    try:
+        record.update(BENCHMARKS[benchmark][0](engine,lot_size,occupancy,radius))
+        record['steps_per_sec'] = record['steps'] / record['seconds'] if record['seconds'] > 0 else None
+    except ImportError as e:
+        record['error'] = str(e)                # e.g. no NumPy for VectorMedium
+    record['peak_memory_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return record
+
+
+def cases(sizes,benchmarks):
+    result = []
+    for benchmark in benchmarks:
+        parameters = sizes[benchmark]
+        for engine in BENCHMARKS[benchmark][1]:
+            for lot_size in parameters['lot_size']:
+                for occupancy in parameters['occupancy']:
+                    for radius in parameters['radius']:
+                        result.append((benchmark,engine,lot_size,occupancy,radius))
+    return result
+
+
+def run_benchmarks(sizes=FULL_SIZES,benchmarks=['medium','mac','full','grow','policy','quiet']):
+    records = []
+    for case in cases(sizes,benchmarks):
+        pool = multiprocessing.Pool(1)
+        try:
+            record = pool.apply(run_case,(case,))
+        finally:
+            pool.close()
+            pool.join()
+        print json.dumps(record,sort_keys=True)
+        sys.stdout.flush()
+        records.append(record)
+    return {'python':platform.python_version(),'machine':platform.machine(),'results':records}
+
+
+def case_key(record):
+    return (record['benchmark'],record['engine'],record['lot_size'],record['occupancy'],record['radius'])
+
+
+def compare(results,baseline,tolerance=0.2):
+    # returns the cases whose steps per second dropped by more than the tolerance since the baseline
+    previous = dict((case_key(record),record) for record in baseline['results'])
+    regressions = []
+    for record in results['results']:
+        old = previous.get(case_key(record))
+        if not old or not old.get('steps_per_sec') or not record.get('steps_per_sec'):
+            continue
+        ratio = record['steps_per_sec'] / old['steps_per_sec']
+        if ratio < 1 - tolerance:
+            regressions.append((case_key(record),old['steps_per_sec'],record['steps_per_sec'],ratio))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the simulator.')
+    parser.add_argument('--quick',action='store_true',help='small lots only')
+    parser.add_argument('--benchmark',action='append',choices=sorted(BENCHMARKS.keys()),help='run only these benchmarks')
+    parser.add_argument('--output',help='write the results to this JSON file')
+    parser.add_argument('--baseline',help='compare with the results in this JSON file')
+    parser.add_argument('--tolerance',type=float,default=0.2,help='the allowed drop in steps per second (default 0.2)')
+    args = parser.parse_args()
+
+    results = run_benchmarks(QUICK_SIZES if args.quick else FULL_SIZES,args.benchmark or ['medium','mac','full','grow','policy','quiet'])
+    if args.output:
+        with open(args.output,'w') as f:
+            json.dump(results,f,indent=1,sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results,baseline,args.tolerance)
+        for (key,old,new,ratio) in regressions:
+            print 'REGRESSION', key, 'steps/sec', old, '->', new, '(%.0f%%)' % (100 * ratio)
+        if regressions:
+            sys.exit(1)
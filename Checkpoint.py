@@ -0,0 +1,89 @@
+"""
+
+Checkpoints
+-----------
+
+Saves the complete state of a trial (an Experiment.Trial) to a file, so that a
+long run can be paused and resumed, or so that many what-if continuations can be
+forked from one expensive prefix (e.g. the tree construction) instead of
+simulating it again for each one.
+
+A checkpoint holds
+    - the medium's tables (signals, signal/node pairs, collision flags)
+    - every MultipleAccess object: FSM state, queues, counters (or the VectorMultipleAccess arrays)
+    - every node: state, timers, parent and child ids, received data
+    - the event scheduler's queue, or the time step
+    - every node's random stream, and the state of the random module
+It's written as a pickle (protocol 2) compressed with zlib, behind a short header.
+Almost all of it is the random streams: each one is a Mersenne Twister state of
+624 words (about 3.4KB compressed, since it's random), so a checkpoint takes
+about 3.5KB per node that has been made, e.g. about 210KB for a 10x10 lot.
+EquivalenceCheck.py checks that a trial resumed from a checkpoint gives the same
+results as one run straight through.
+
+The event log isn't part of a checkpoint: it's handed to load_checkpoint, and the
+restored trial logs the events that come after the checkpoint to it (after a
+trial start marker). To fork continuations:
+
+    trial = Trial(TextEventLog('prefix.txt'),...)
+    trial.run(stop_at=5000)
+    save_checkpoint('lot.ckpt',trial)
+    for p in [0.02,0.05,0.1]:
+        trial = load_checkpoint('lot.ckpt',TextEventLog('p' + str(p) + '.txt'))
+        trial.p = p                     # for the nodes that haven't been made yet
+        for node in [trial.sink] + trial.nodes:
+            node.network_interface.p = p
+        trial.run()
+
+
+"""
+
+
+from cStringIO import StringIO
+import cPickle as pickle
+import copy_reg
+import random
+import types
+import zlib
+
+MAGIC = 'SNSCKPT1'
+EVENT_LOG = 'event_log'         # stands in for the event log in the pickle
+
+
+def reduce_method(method):
+    # bound methods (e.g. the event scheduler's Trial.create_node) are pickled by name
+    return (getattr,(method.im_self,method.im_func.__name__))
+
+copy_reg.pickle(types.MethodType,reduce_method)
+
+
+def dumps(trial):
+    # the checkpoint of a trial, as a string
+    data = StringIO()
+    pickler = pickle.Pickler(data,pickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = lambda obj: EVENT_LOG if obj is trial.event_log else None
+    pickler.dump((trial,random.getstate()))
+    return MAGIC + zlib.compress(data.getvalue())
+
+
+def loads(checkpoint,event_log):
+    # restore a trial from dumps(), logging to event_log from now on
+    if not checkpoint.startswith(MAGIC):
+        raise Exception('not a checkpoint')
+    unpickler = pickle.Unpickler(StringIO(zlib.decompress(checkpoint[len(MAGIC):])))
+    unpickler.persistent_load = lambda persistent_id: event_log
+    (trial,state) = unpickler.load()
+    random.setstate(state)
+    event_log.start_trial(trial.topology.node_count())
+    event_log.set_time(trial.time)
+    return trial
+
+
+def save_checkpoint(path,trial):
+    with open(path,'wb') as f:
+        f.write(dumps(trial))
+
+
+def load_checkpoint(path,event_log):
+    with open(path,'rb') as f:
+        return loads(f.read(),event_log)
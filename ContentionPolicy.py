@@ -0,0 +1,138 @@
+"""
+
+Contention Policies
+-------------------
+
+Ways for a node's MultipleAccess object to adapt its CSMA parameters to the
+density and load around it, instead of using the same fixed p, contention
+window and ACK wait as every other node. A MultipleAccess object tells each of
+its policies (see MultipleAccess.set_policies) about
+
+    sensed(mac,busy)            every carrier sense before a send (busy: the medium wasn't clear)
+    acked(mac,round_trip)       every packet whose ACKs all came in, with the time steps from
+                                sending it to the last ACK (None if it was re-transmitted, as
+                                the ACK may be for an earlier copy)
+    timed_out(mac)              every ACK wait that ran out
+
+and a policy may change mac.p, mac._contention_window and mac._ack_wait. A policy
+object can be shared by all of the nodes: it keeps each node's state on the node's
+MultipleAccess object, set up by attach(mac).
+
+BinaryExponentialBackoff    doubles the contention window after each ACK timeout (up to
+                            max_window), and goes back to the node's own after an ACK
+AdaptivePersistence         keeps a moving average of the fraction of carrier senses that
+                            found the medium busy (an ACK timeout counts as one, as the
+                            packet most likely collided), and sends with a p between p_max
+                            (the medium is never busy) and p_min (it always is)
+RoundTripAckWait            waits for ACKs for the smoothed round trip plus four times its
+                            mean deviation (as TCP does for its retransmission timeout),
+                            doubling the wait after each timeout
+
+Pass them to the trial: run_trial(...,policies=[BinaryExponentialBackoff(),
+RoundTripAckWait()]). Trial.node_stats() has each node's MAC statistics (see
+MultipleAccess.stats), and summarize() sums them up; python Benchmark.py
+--benchmark policy compares the policies.
+
+
+"""
+
+
+import math
+
+
+class ContentionPolicy:
+    # the fixed parameters: every hook does nothing
+    def attach(self,mac):
+        pass
+
+    def sensed(self,mac,busy):
+        pass
+
+    def acked(self,mac,round_trip):
+        pass
+
+    def timed_out(self,mac):
+        pass
+
+
+class BinaryExponentialBackoff(ContentionPolicy):
+    def __init__(self,max_window=255):
+        self.max_window = max_window
+
+    def attach(self,mac):
+        mac.base_window = int(mac._contention_window)
+
+    def acked(self,mac,round_trip):
+        mac._contention_window = mac.base_window
+
+    def timed_out(self,mac):
+        mac._contention_window = min(2 * int(mac._contention_window) + 1,self.max_window)
+
+
+class AdaptivePersistence(ContentionPolicy):
+    def __init__(self,p_min=0.01,p_max=0.2,weight=1 / 16.0):
+        self.p_min = p_min
+        self.p_max = p_max
+        self.weight = weight            # the weight of each new carrier sense in the moving average
+
+    def attach(self,mac):
+        # start from the busy fraction that gives the node's own p
+        busy = (self.p_max - float(mac.p)) / (self.p_max - self.p_min)
+        mac.busy_estimate = min(max(busy,0.0),1.0)
+
+    def sensed(self,mac,busy):
+        mac.busy_estimate += self.weight * ((1.0 if busy else 0.0) - mac.busy_estimate)
+        mac.p = self.p_max - (self.p_max - self.p_min) * mac.busy_estimate
+
+    def timed_out(self,mac):
+        self.sensed(mac,True)
+
+
+class RoundTripAckWait(ContentionPolicy):
+    def __init__(self,min_wait=20,max_wait=None):
+        self.min_wait = min_wait
+        self.max_wait = max_wait        # None: the node's own ACK wait
+
+    def attach(self,mac):
+        mac.max_ack_wait = self.max_wait if self.max_wait is not None else int(mac._ack_wait)
+        mac.smoothed_round_trip = None
+        mac.round_trip_deviation = None
+
+    def acked(self,mac,round_trip):
+        if round_trip is None:
+            return
+        if mac.smoothed_round_trip is None:
+            mac.smoothed_round_trip = float(round_trip)
+            mac.round_trip_deviation = round_trip / 2.0
+        else:
+            mac.round_trip_deviation += (abs(mac.smoothed_round_trip - round_trip) - mac.round_trip_deviation) / 4.0
+            mac.smoothed_round_trip += (round_trip - mac.smoothed_round_trip) / 8.0
+        wait = int(math.ceil(mac.smoothed_round_trip + 4 * mac.round_trip_deviation))
+        mac._ack_wait = min(max(wait,self.min_wait),mac.max_ack_wait)
+
+    def timed_out(self,mac):
+        mac._ack_wait = min(2 * int(mac._ack_wait),mac.max_ack_wait)
+
+
+# the policy sets that Benchmark.py compares
+POLICY_SETS = {'fixed':[],
+               'binary exponential backoff':[BinaryExponentialBackoff()],
+               'adaptive persistence':[AdaptivePersistence()],
+               'round trip ack wait':[RoundTripAckWait()],
+               'all':[BinaryExponentialBackoff(),AdaptivePersistence(),RoundTripAckWait()]}
+
+
+def summarize(node_stats,time):
+    # sum up Trial.node_stats() for a trial that took the given time steps: the packets
+    # delivered per time step (throughput), their mean time steps from queueing to delivery
+    # (latency), and the transmissions, re-transmissions and ACK timeouts of all the nodes.
+    stats = node_stats.values()
+    delivered = sum(node['delivered'] for node in stats)
+    delivery_ticks = sum(node['latency'] * node['delivered'] for node in stats if node['delivered'])
+    return {'nodes':len(stats),
+            'delivered':delivered,
+            'throughput':delivered / float(time) if time else None,
+            'latency':delivery_ticks / float(delivered) if delivered else None,
+            'transmissions':sum(node['transmissions'] for node in stats),
+            'retransmissions':sum(node['retransmissions'] for node in stats),
+            'ack_timeouts':sum(node['ack_timeouts'] for node in stats)}
@@ -0,0 +1,116 @@
+"""
+
+Equivalence Check Script
+-----------------
+
+VectorMedium, EventScheduler, VectorMultipleAccess and the sharded trial (see
+ShardedMedium.py) are only worth having if they give exactly the same results as
+Medium2.Medium and one MultipleAccess per node updated on every time step. This script runs
+trials on fixed seeds with each engine and compares the event logs and the
+number of time steps with those of the reference engine:
+python EquivalenceCheck.py [trials] [seed]
+
+A trial saved to a checkpoint partway through and finished from it (see
+Checkpoint.py) has to give the same results too, so that is checked the same way.
+
+It prints one line per trial and engine, and exits with status 1 on any mismatch.
+
+
+"""
+
+
+from Experiment import run_trial, Trial
+from EventLog import TextEventLog
+from Checkpoint import dumps, loads
+from ParallelRunner import trial_seeds
+import random
+import tempfile
+import sys
+import os
+
+# give up on a trial (as the reference does) after this many time steps
+MAX_STEPS = 100000
+
+# the reference engine first
+ENGINES = [('tick loop, Medium2',{}),
+           ('tick loop, Medium2, all nodes made up front',{'lazy_nodes':False}),
+           ('tick loop, VectorMedium',{'use_vector_medium':True}),
+           ('event scheduler, Medium2',{'use_event_scheduler':True}),
+           ('event scheduler, VectorMedium',{'use_vector_medium':True,'use_event_scheduler':True}),
+           ('event scheduler, Medium2, all nodes made up front',{'use_event_scheduler':True,'lazy_nodes':False}),
+           ('tick loop, Medium2, VectorMultipleAccess',{'use_vector_mac':True}),
+           ('tick loop, VectorMedium, VectorMultipleAccess',{'use_vector_medium':True,'use_vector_mac':True}),
+           ('tick loop, sharded Medium2, 2x2 tiles',{'tiles':(2,2)}),
+           ('tick loop, Medium2, resumed from a checkpoint at step 20000',{'checkpoint_at':20000}),
+           ('event scheduler, VectorMedium, resumed from a checkpoint at step 20000',
+            {'use_vector_medium':True,'use_event_scheduler':True,'checkpoint_at':20000})]
+
+
+def run_engine(seed,options):
+    # run one trial, returning (steps or the error, the event log)
+    (handle,log_file) = tempfile.mkstemp(suffix='.txt')
+    os.close(handle)
+    try:
+        if 'checkpoint_at' in options:
+            steps = run_resumed(log_file,seed,**options)
+        else:
+            steps = run_trial(log_file,seed=seed,max_steps=MAX_STEPS,**options)
+    except Exception as e:
+        steps = str(e)
+    with open(log_file) as f:
+        log = f.read()
+    os.remove(log_file)
+    return (steps,log)
+
+
+def run_resumed(log_file,seed,checkpoint_at,**options):
+    # run a trial to a time step, save a checkpoint and throw the trial away, then finish
+    # it from the checkpoint. The events after the checkpoint are added to the log file
+    # without the start marker that the resumed trial's log begins with.
+    event_log = TextEventLog(log_file,append=True)
+    try:
+        trial = Trial(event_log,seed=seed,**options)
+        steps = trial.run(max_steps=MAX_STEPS,stop_at=checkpoint_at)
+    finally:
+        event_log.close()
+    if steps is not None:
+        return steps            # it finished before the checkpoint
+    checkpoint = dumps(trial)
+    del trial
+    random.random()             # the checkpoint restores the random module's state too
+    (handle,resumed_file) = tempfile.mkstemp(suffix='.txt')
+    os.close(handle)
+    event_log = TextEventLog(resumed_file)
+    try:
+        return loads(checkpoint,event_log).run(max_steps=MAX_STEPS)
+    finally:
+        event_log.close()
+        with open(resumed_file) as f:
+            lines = f.readlines()
+        os.remove(resumed_file)
+        with open(log_file,'a') as f:
+            f.writelines(lines[1:])
+
+
+def check(trials=3,seed=0,engines=ENGINES):
+    # returns True if every engine matches the reference on every trial
+    matched = True
+    for trial_seed in trial_seeds(seed,trials):
+        (reference_name,reference_options) = engines[0]
+        reference = run_engine(trial_seed,reference_options)
+        print trial_seed, reference_name, reference[0]
+        for (name,options) in engines[1:]:
+            result = run_engine(trial_seed,options)
+            if result == reference:
+                print trial_seed, name, 'OK'
+            else:
+                print trial_seed, name, 'MISMATCH', result[0]
+                matched = False
+    return matched
+
+
+if __name__ == '__main__':
+    trials = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    if not check(trials,seed):
+        sys.exit(1)
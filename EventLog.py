@@ -0,0 +1,190 @@
+"""
+
+Event Logs
+----------
+
+Sinks for the protocol events that nodes log (Node.log_event). Nodes used to
+open the output file, append one line and close it again for every event.
+An event log instead keeps the events in a fixed-size in-memory buffer and
+writes them out in one batch whenever the buffer fills up (and on close),
+through a file handle that stays open.
+
+An event log has these methods:
+    start_trial(node_count)     mark the start of a trial
+    set_time(time)              the time step of the events that follow
+                                (set by the simulation loop / EventScheduler)
+    log(node_id,event)          record an event
+    end_trial(time,ids_received)    mark the end of a trial: the time step at which the
+                                sink got the data, and the number of node ids it got
+    flush()                     write out the buffered events
+    close()                     flush and close the file
+
+TeeEventLog passes the events on to several event logs, e.g. a TextEventLog and
+an OnlineStats.StatsEventLog.
+
+TextEventLog writes the same format as before (a '#<node count>' line per
+trial, then '<node id>\t<event>' lines), so existing analysis keeps working.
+
+BinaryEventLog writes fixed-width little-endian records (see RECORD):
+    trial       int32
+    time        int32   the time step
+    node        int32   an index into the node labels (-1 for a trial start)
+    event       uint8   see EVENT_CODES (TRIAL_START for a trial start)
+    ids_sent    int32   the number of ids sent in a DATA message (the node count for a trial start)
+The node labels (e.g. '3_4') are appended to <path>.nodes, one per line, in
+index order. read_binary_log reads the records back.
+
+
+"""
+
+
+import struct
+
+# fixed-width record: trial, time, node, event, ids_sent
+RECORD = struct.Struct('<iiiBi')
+
+# event codes
+TRIAL_START = 0
+EVENT_CODES = {'broadcast':1,'ack_of_parent':2,'grow_command':3,'ids_sent':4}
+EVENT_NAMES = dict((code,name) for (name,code) in EVENT_CODES.items())
+EVENT_NAMES[TRIAL_START] = 'trial_start'
+
+
+def parse_event(event):
+    # split a logged event into its type and ids_sent count, e.g. 'ids_sent_12' -> ('ids_sent',12)
+    if event.startswith('ids_sent_'):
+        return ('ids_sent',int(event[len('ids_sent_'):]))
+    return (event,0)
+
+
+class EventLog:
+    # buffers events and hands them to write() in batches. Subclasses implement write().
+    def __init__(self,capacity=4096):
+        self.capacity = capacity            # the number of events buffered before a flush
+        self.buffer = [None] * capacity
+        self.count = 0                      # the number of buffered events
+        self.time = 0                       # the current time step
+        self.trial = -1                     # the current trial
+
+    def set_time(self,time):
+        self.time = time
+
+    def start_trial(self,node_count):
+        self.trial += 1
+        self.time = 0
+        self.append((self.trial,0,None,'#',node_count))
+
+    def log(self,node_id,event):
+        self.append((self.trial,self.time,node_id,event,None))
+
+    def end_trial(self,time,ids_received):
+        pass
+
+    def append(self,record):
+        self.buffer[self.count] = record
+        self.count += 1
+        if self.count == self.capacity:
+            self.flush()
+
+    def flush(self):
+        if self.count:
+            self.write(self.buffer[:self.count])
+            self.count = 0
+
+    def write(self,records):
+        raise Exception('write() is not implemented')
+
+    def close(self):
+        self.flush()
+
+
+class TeeEventLog(EventLog):
+    # hands everything to each of a list of event logs
+    def __init__(self,event_logs):
+        EventLog.__init__(self,capacity=1)
+        self.event_logs = event_logs
+
+    def set_time(self,time):
+        self.time = time
+        for event_log in self.event_logs:
+            event_log.set_time(time)
+
+    def start_trial(self,node_count):
+        for event_log in self.event_logs:
+            event_log.start_trial(node_count)
+
+    def log(self,node_id,event):
+        for event_log in self.event_logs:
+            event_log.log(node_id,event)
+
+    def end_trial(self,time,ids_received):
+        for event_log in self.event_logs:
+            event_log.end_trial(time,ids_received)
+
+    def flush(self):
+        for event_log in self.event_logs:
+            event_log.flush()
+
+    def close(self):
+        for event_log in self.event_logs:
+            event_log.close()
+
+
+class TextEventLog(EventLog):
+    # the output.txt format
+    def __init__(self,path,capacity=4096,append=False):
+        EventLog.__init__(self,capacity)
+        self.file = open(path,'a' if append else 'w')
+
+    def write(self,records):
+        lines = []
+        for (trial,time,node_id,event,node_count) in records:
+            if node_id is None:
+                lines.append('#' + str(node_count) + '\n')
+            else:
+                lines.append(node_id + '\t' + event + '\n')
+        self.file.write(''.join(lines))
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class BinaryEventLog(EventLog):
+    # fixed-width records, with the node labels in a separate file
+    def __init__(self,path,capacity=4096):
+        EventLog.__init__(self,capacity)
+        self.file = open(path,'wb')
+        self.labels_file = open(path + '.nodes','w')
+        self.node_index = {}                # node label -> index
+
+    def write(self,records):
+        chunks = []
+        labels = []
+        for (trial,time,node_id,event,node_count) in records:
+            if node_id is None:
+                chunks.append(RECORD.pack(trial,time,-1,TRIAL_START,node_count))
+                continue
+            if node_id not in self.node_index:
+                self.node_index[node_id] = len(self.node_index)
+                labels.append(node_id + '\n')
+            (name,ids_sent) = parse_event(event)
+            chunks.append(RECORD.pack(trial,time,self.node_index[node_id],EVENT_CODES[name],ids_sent))
+        self.file.write(''.join(chunks))
+        self.labels_file.write(''.join(labels))
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        self.labels_file.close()
+
+
+def read_binary_log(path):
+    # yields (trial, time, node label or None, event name, ids_sent) for each record of a BinaryEventLog
+    with open(path + '.nodes') as f:
+        labels = [line.rstrip('\n') for line in f]
+    with open(path,'rb') as f:
+        data = f.read()
+    for offset in range(0,len(data),RECORD.size):
+        (trial,time,node,event,ids_sent) = RECORD.unpack_from(data,offset)
+        yield (trial,time,labels[node] if node >= 0 else None,EVENT_NAMES[event],ids_sent)
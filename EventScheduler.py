@@ -0,0 +1,143 @@
+'''
+The EventScheduler Class
+------------------------
+
+A next-event replacement for the fixed time step loop in Simulation.py.
+
+The tick loop updates every node, and the medium, on every time step, even though
+most nodes spend most of their time either doing nothing or counting down a timer
+(grow_timeout, the ACK wait, a backoff counter). The scheduler keeps a priority
+queue of the time steps at which each node has to be updated:
+    - the step at which one of its timers runs out (Node.idle_ticks)
+    - the step after a message was queued for it
+    - the step at which the medium delivers a packet to it
+Nodes are fast-forwarded over the steps they sit out (Node.skip), the medium is
+only updated while signals are propagating, and when the medium is empty the
+clock jumps straight to the next wake-up time.
+
+Nodes due at the same time step are updated in the same order as in the tick loop
+(the sink, then the nodes in the order given), so the random number draws, and
+therefore the results, are the same as the tick loop's.
+
+Nodes are kept by id. Given create_node, the scheduler makes the nodes it hasn't
+got when the medium first delivers a packet to them (see Experiment.Trial's
+lazy_nodes), and updates them in id order. It finishes when every data sink
+among the nodes has got its data.
+
+'''
+import heapq
+
+
+class EventScheduler:
+    def __init__(self,sink,nodes,medium,event_log=None,create_node=None):
+        self.sink = sink
+        self.nodes = {}                             # node_id -> node
+        self.rank = {}                              # node_id -> position in the update order: the sink first, as in the tick loop
+        self.last_update = {}                       # node_id -> the last time step the node was updated
+        self.wake_time = {}                         # node_id -> the next time step the node has to be updated
+        self.queue = []                             # a heap of (wake_time, rank, node_id)
+        self.medium = medium
+        self.event_log = event_log                  # told the time step before the nodes log events (see EventLog.py)
+        self.create_node = create_node              # makes the node with an id that the medium delivers a packet to, for
+                                                    # nodes that are made lazily (see Experiment.Trial). Their ids are ints,
+                                                    # in update order.
+        self.time = 0                               # the last time step that was simulated
+        self.sinks = set([node.id for node in [sink] + list(nodes) if node.i_am_the_data_sink] or [sink.id])
+        self.done_sinks = set()                     # the sinks that have got all of their data
+        self.finished = False                       # have all of the sinks got all of their data?
+        self.updates = 0                            # the number of node updates performed
+        self.removed = set()                        # the ids of the nodes that have gone (never made again)
+        self.add_node(sink,(0,0))
+        for index,node in enumerate(nodes):
+            self.add_node(node,(1,node.id if create_node else index))
+
+    def add_node(self,node,rank):
+        # start scheduling a node, as of the current time step.
+        self.nodes[node.id] = node
+        self.rank[node.id] = rank
+        self.last_update[node.id] = self.time
+        self.wake_time[node.id] = None
+        self.schedule_node(node.id)
+
+    def remove_node(self,node_id):
+        # stop scheduling a node (e.g. a car that left the lot), and never make it.
+        if node_id in self.nodes:
+            del self.nodes[node_id]
+            self.wake_time[node_id] = None
+        self.removed.add(node_id)
+
+    def restart(self):
+        # the sinks have started another sample: schedule them again. A finished sink
+        # isn't updated while it waits, so it starts from now.
+        self.done_sinks = set()
+        self.finished = False
+        for node_id in self.sinks:
+            self.last_update[node_id] = self.time
+            self.schedule_node(node_id)
+
+    def wake(self,node_id,time):
+        # make sure a node is updated at the given time step.
+        if self.wake_time[node_id] is None or time < self.wake_time[node_id]:
+            self.wake_time[node_id] = time
+            heapq.heappush(self.queue,(time,self.rank[node_id],node_id))
+
+    def schedule_node(self,node_id):
+        # schedule a node's next update from its timers.
+        ticks = self.nodes[node_id].idle_ticks()
+        if ticks is not None:
+            self.wake(node_id,self.last_update[node_id] + ticks + 1)
+
+    def next_time(self):
+        # the next time step at which something happens.
+        if not self.medium.is_idle():
+            return self.time + 1
+        while self.queue:
+            (time,rank,node_id) = self.queue[0]
+            if self.wake_time[node_id] == time:
+                return time
+            heapq.heappop(self.queue)               # a stale entry
+        return None
+
+    def step(self):
+        # simulate the next time step at which something happens.
+        # returns True once the sinks have got the data (like Node.update).
+        time = self.next_time()
+        if time is None:
+            raise Exception("nothing is scheduled: the simulation can't progress")
+        self.time = time
+        if self.event_log:
+            self.event_log.set_time(time)
+        due = {}
+        while self.queue and self.queue[0][0] <= time:
+            (wake_time,rank,node_id) = heapq.heappop(self.queue)
+            if self.wake_time[node_id] == time:
+                due[rank] = node_id
+        for rank in sorted(due):
+            node_id = due[rank]
+            node = self.nodes[node_id]
+            self.wake_time[node_id] = None
+            node.skip(time - self.last_update[node_id] - 1)
+            output = node.update()
+            self.last_update[node_id] = time
+            self.updates += 1
+            if output and node_id in self.sinks:
+                self.done_sinks.add(node_id)
+            if node_id not in self.done_sinks:
+                # a sink with its data does nothing until the next sample (see restart)
+                self.schedule_node(node_id)
+        if len(self.done_sinks) == len(self.sinks):
+            self.finished = True
+        if not self.medium.is_idle():
+            self.medium.update()
+            for node_id in self.medium.get_receiving_node_ids():
+                if node_id not in self.nodes and self.create_node and node_id not in self.removed:
+                    self.add_node(self.create_node(node_id),(1,node_id))
+                if node_id in self.nodes:
+                    self.wake(node_id,time + 1)
+        return self.finished
+
+    def run(self):
+        # simulate until the sinks have got the data. returns the number of time steps.
+        while not self.step():
+            pass
+        return self.time
@@ -0,0 +1,509 @@
+"""
+
+Experiment Script (headless)
+-----------------
+
+Runs the in-network data aggregation experiment without a display:
+python Experiment.py
+
+Nothing here imports pygame. Rendering is an optional observer (see Renderer.py)
+that Simulation.py passes in. An observer has two methods:
+    start(sink,nodes)   called before the first time step of a trial
+    update(time)        called after every simulated time step, with that time step
+                        (the event scheduler skips time steps in which nothing happens)
+
+A trial can also be profiled (see Profiler.py): run_trial(...,profiler=Profiler()).
+
+A Trial holds the complete state of one trial and can be run in pieces
+(Trial.run(stop_at=...)), and saved and restored in between (see Checkpoint.py).
+
+With use_vector_mac, the nodes' MultipleAccess objects are replaced by one batched
+engine (see VectorMultipleAccess.py), which is updated once per time step.
+
+The lot is laid out by a generator from Topology.py (a grid lot by default), and
+nodes are made as the tree reaches them (see Trial), so lots of 100k nodes start
+in well under a second. With run_trial(...,tiles=(columns,rows)), the lot is split
+into tiles simulated side by side by worker processes (see ShardedMedium.py).
+
+
+"""
+
+
+from Medium2 import Medium
+from Node import Node
+from EventScheduler import EventScheduler
+from EventLog import EventLog, TextEventLog
+from RandomStreams import lot_random, node_random, churn_random
+from Topology import Topology, NodeRecord, grid_lot
+import random
+import bisect
+import math
+
+
+def create_nodes(event_log,occupancy=.62,lot_size=10,stream=random):
+    # fill a lot_size x lot_size lot, each space occupied with the given probability
+    # (the nodes of a grid_lot without its sink, all made at once)
+    topology = grid_lot(stream,lot_size,occupancy,sink=False)
+    nodes = []
+    for node_id in topology.node_ids():
+        (x,y) = topology.position(node_id)
+        node = Node(x,y,node_id,topology.label(node_id))
+        node.set_event_log(event_log) # give it the event log
+        nodes.append(node)
+    return nodes
+
+
+def make_topology(topology,seed,lot_size=10,occupancy=.62):
+    # a trial's lot: a lot_size x lot_size grid lot, or made by a generator given as topology
+    # (called with the trial's lot stream), or the given Topology
+    if topology is None:
+        return grid_lot(lot_random(seed),lot_size,occupancy)
+    elif not isinstance(topology,Topology):
+        return topology(lot_random(seed))
+    return topology
+
+
+def set_parameters(node,radius=2,p=0.05,contention_window=3,channels=1,concurrent_grow=False,grow_quiet_factor=None):
+    # the physical, protocol and CSMA parameters of a node
+    node.radius = radius
+    node.channels = channels
+    node.concurrent_grow = concurrent_grow
+    node.grow_quiet_factor = grow_quiet_factor
+    node.network_interface.p = p
+    node.network_interface.set_contention_window(contention_window)
+
+
+def run_trial(output_file,use_vector_medium=False,use_event_scheduler=False,observer=None,
+              seed=None,occupancy=.62,radius=2,p=0.05,contention_window=3,max_steps=None,lot_size=10,
+              profiler=None,use_vector_mac=False,topology=None,lazy_nodes=True,phy=None,channels=1,
+              samples=1,cache_tree=False,churn=0.0,concurrent_grow=False,policies=None,grow_quiet_factor=None,
+              tiles=None):
+    # simulate one random lot until the sink has the data. returns the number of time steps.
+    # The events go to output_file, which is either an event log (see EventLog.py) or the name
+    # of a file to append them to in the output.txt format.
+    # Some lots never finish (e.g. when no node is in range of the sink, the sink retransmits
+    # its DATA forever), so a batch run can give up after max_steps time steps with an exception.
+    if profiler:
+        profiler.enable()
+    if isinstance(output_file,EventLog):
+        event_log = output_file
+    else:
+        event_log = TextEventLog(output_file,append=True)
+    try:
+        return simulate(event_log,use_vector_medium,use_event_scheduler,observer,
+                        occupancy,radius,p,contention_window,max_steps,lot_size,profiler,use_vector_mac,seed,
+                        topology,lazy_nodes,phy,channels,samples,cache_tree,churn,concurrent_grow,policies,
+                        grow_quiet_factor,tiles)
+    finally:
+        if event_log is not output_file:
+            event_log.close()
+        if profiler:
+            profiler.disable()
+
+
+def simulate(event_log,use_vector_medium,use_event_scheduler,observer,
+             occupancy,radius,p,contention_window,max_steps,lot_size,profiler=None,use_vector_mac=False,seed=None,
+             topology=None,lazy_nodes=True,phy=None,channels=1,samples=1,cache_tree=False,churn=0.0,
+             concurrent_grow=False,policies=None,grow_quiet_factor=None,tiles=None):
+    # the body of run_trial, logging to an event log
+    if tiles:
+        # split the lot into tiles, each simulated by a worker process (with Medium2 and the time step loop)
+        if use_vector_medium or use_event_scheduler or use_vector_mac or observer or profiler:
+            raise Exception("a sharded trial runs Medium2 with the time step loop, without an observer or profiler")
+        if samples != 1 or cache_tree or churn:
+            raise Exception("a sharded trial collects one sample")
+        from ShardedMedium import ShardedTrial
+        trial = ShardedTrial(event_log,tiles,occupancy,radius,p,contention_window,lot_size,seed,topology,lazy_nodes,
+                             phy,channels,concurrent_grow,policies,grow_quiet_factor)
+        return trial.run(max_steps)
+    trial = Trial(event_log,use_vector_medium,use_event_scheduler,occupancy,radius,p,contention_window,lot_size,use_vector_mac,seed,
+                  topology,lazy_nodes,phy,channels,samples,cache_tree,churn,concurrent_grow,policies,grow_quiet_factor)
+    return trial.run(observer,profiler,max_steps)
+
+
+class TreeIndex:
+    # Tree nodes that a free car can be repaired through (see Trial.repair_near), in a grid with
+    # cells as wide as the largest radius, so finding the nearest one in range of a car only
+    # visits the cells around it. The nodes keep the order they were given in, which breaks ties.
+    def __init__(self,nodes):
+        self.cell_size = float(max([node.radius for node in nodes] + [1]))
+        self.cells = {}                 # (cell_x,cell_y) -> the nodes in that cell
+        self.order = {}                 # node_id -> its place in the given order
+        for (index,node) in enumerate(nodes):
+            self.order[node.id] = index
+            self.cells.setdefault(self.cell(node.x,node.y),[]).append(node)
+
+    def cell(self,x,y):
+        return (int(math.floor(x / self.cell_size)),int(math.floor(y / self.cell_size)))
+
+    def remove(self,node):
+        if node.id in self.order:
+            del self.order[node.id]
+            cell = self.cell(node.x,node.y)
+            self.cells[cell].remove(node)
+            if not self.cells[cell]:
+                del self.cells[cell]
+
+    def near(self,x,y):
+        # the nodes that might have the point in range, in order
+        (cell_x,cell_y) = self.cell(x,y)
+        nodes = []
+        for i in range(cell_x - 1,cell_x + 2):
+            for j in range(cell_y - 1,cell_y + 2):
+                nodes.extend(self.cells.get((i,j),()))
+        nodes.sort(key=lambda node: self.order[node.id])
+        return nodes
+
+
+class Trial:
+    # The complete state of one trial: the nodes (with their MultipleAccess objects),
+    # the medium, and the scheduler or the step count. It can be run in pieces, and
+    # saved and restored between them (see Checkpoint.py).
+    #
+    # The lot is a Topology (see Topology.py): by default a lot_size x lot_size grid lot,
+    # or made by a generator given as topology (called with the trial's lot stream).
+    # With lazy_nodes, a node is only made when the first packet reaches it (until then
+    # it would do nothing but wait), so a large lot starts quickly and the nodes that the
+    # tree never reaches cost nothing. The vector MAC needs all of its nodes up front.
+    #
+    # phy is the medium's physical layer model (see Phy.py), the default if None.
+    # With channels > 1, each node collects its subtree's data on its own channel (see Node.data_channel).
+    # With concurrent_grow, a node commands its children that are out of range of each other at once,
+    # instead of one at a time (see Node.command_separated_children).
+    # policies are the contention policies every node's MAC adapts its CSMA parameters with
+    # (see ContentionPolicy.py); node_stats() has each node's MAC statistics.
+    # With grow_quiet_factor, a node ends its GROW window once no child has replied for a quiet
+    # period scaled to the contention it expects, instead of always waiting grow_timeout (see Node.quiet_period).
+    #
+    # The sinks collect the data samples times (the trial ends with the last one). With cache_tree,
+    # the nodes keep the tree from one sample to the next, so later samples skip the annexing
+    # (see Node.start_sample). Between samples each car leaves with probability churn, and as
+    # many arrive at random places in the lot. Only the tree nodes nearest the cars that lost their
+    # parent or just arrived annex free nodes again (see car_leaves and cars_arrive).
+    # self.sample_records has the latency, transmissions and ids received of each sample.
+    def __init__(self,event_log,use_vector_medium=False,use_event_scheduler=False,occupancy=.62,radius=2,
+                 p=0.05,contention_window=3,lot_size=10,use_vector_mac=False,seed=None,topology=None,lazy_nodes=True,
+                 phy=None,channels=1,samples=1,cache_tree=False,churn=0.0,concurrent_grow=False,policies=None,
+                 grow_quiet_factor=None):
+        # the trial's seed (drawn from the random module if not given) seeds all of its random streams
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+        self.event_log = event_log
+        self.radius = radius
+        self.p = p
+        self.contention_window = contention_window
+        self.channels = channels
+        self.concurrent_grow = concurrent_grow
+        self.grow_quiet_factor = grow_quiet_factor
+        self.policies = policies
+        self.cache_tree = cache_tree
+        self.samples = samples
+        self.churn = churn
+        self.churn_random = churn_random(seed)
+
+        # lay out the lot
+        topology = make_topology(topology,seed,lot_size,occupancy)
+        self.topology = topology
+
+        # mark the start of one simulation
+        event_log.start_trial(topology.node_count())
+
+        # create the medium, and register every node's position with it
+        if use_vector_medium:
+            from VectorMedium import VectorMedium
+            medium = VectorMedium(phy)
+        else:
+            medium = Medium(phy)
+        medium.connect_to_the_nodes(topology.records(radius))
+        self.medium = medium
+
+        # the nodes, other than the first sink, in update order (by id)
+        self.nodes = []
+        self.node_ids = []
+
+        # create the data sinks (the first one is updated first)
+        self.sinks = [self.create_node(node_id) for node_id in topology.sinks]
+        self.sink = self.sinks[0]
+        self.nodes.remove(self.sink)
+        self.node_ids.remove(self.sink.id)
+        if use_vector_mac or not lazy_nodes:
+            for node_id in topology.node_ids():
+                self.create_node(node_id)
+
+        # swap in the batched MAC engine (in update order)
+        mac = None
+        if use_vector_mac:
+            if use_event_scheduler:
+                raise Exception("the vector MAC works with the time step loop only")
+            from VectorMultipleAccess import VectorMultipleAccess
+            mac = VectorMultipleAccess([self.sink] + self.nodes)
+            mac.connect_to_the_medium(medium)
+        self.mac = mac
+        self.lazy_nodes = lazy_nodes and not use_vector_mac
+        if churn and use_vector_mac:
+            raise Exception("the vector MAC can't add or remove nodes")
+        self.departed = set()           # the ids of the cars that have left
+        self.departed_transmissions = 0 # the packets they put on the medium
+
+        # set as sink nodes (they initiate the process)
+        for sink in self.sinks:
+            sink.set_as_sink()
+
+        self.scheduler = None
+        if use_event_scheduler:
+            self.scheduler = EventScheduler(self.sink,list(self.nodes),medium,event_log,
+                                            self.create_node if self.lazy_nodes else None)
+        self.time = 0                   # the last time step simulated
+        self.finished = False           # have the sinks got the data?
+        self.done_sinks = set()         # the ids of the sinks that have got their data
+        self.sample = 1                 # the sample being collected
+        self.sample_start = 0           # the time step it started at
+        self.sample_transmissions = 0   # the transmissions before it started
+        self.sample_records = []        # {'sample','start','latency','transmissions','ids_received'} per sample collected
+
+    def create_node(self,node_id):
+        # make the node with the given topology id, connected to the medium, and add it to the update order
+        (x,y) = self.topology.position(node_id)
+        node = Node(x,y,node_id,self.topology.label(node_id))
+        if node_id not in self.topology.sinks:
+            node.set_event_log(self.event_log) # give it the event log (the sinks' events have never been logged)
+        set_parameters(node,self.radius,self.p,self.contention_window,self.channels,self.concurrent_grow,
+                       self.grow_quiet_factor)
+        node.cache_tree = self.cache_tree
+        if self.policies:
+            node.network_interface.set_policies(self.policies)
+        node.network_interface.set_random(node_random(self.seed,node.label))
+        node.connect_to_the_medium(self.medium)
+        index = bisect.bisect(self.node_ids,node_id)
+        self.node_ids.insert(index,node_id)
+        self.nodes.insert(index,node)
+        return node
+
+    def create_receiving_nodes(self):
+        # make the nodes that the medium is delivering their first packet to
+        for node_id in self.medium.get_receiving_node_ids():
+            index = bisect.bisect_left(self.node_ids,node_id)
+            if index == len(self.node_ids) or self.node_ids[index] != node_id:
+                if node_id != self.sink.id and node_id not in self.departed:
+                    self.create_node(node_id)
+
+    def node_by_id(self,node_id):
+        # the node with the given id, or None if it hasn't been made (or has left)
+        if node_id == self.sink.id:
+            return self.sink
+        index = bisect.bisect_left(self.node_ids,node_id)
+        if index < len(self.node_ids) and self.node_ids[index] == node_id:
+            return self.nodes[index]
+        return None
+
+    def transmissions(self):
+        # the packets put on the medium so far, by every node (including the ones that have left)
+        return (self.departed_transmissions + self.sink.network_interface.transmissions +
+                sum(node.network_interface.transmissions for node in self.nodes))
+
+    def end_sample(self):
+        self.sample_records.append({'sample':self.sample,
+                                    'start':self.sample_start,
+                                    'latency':self.time - self.sample_start,
+                                    'transmissions':self.transmissions() - self.sample_transmissions,
+                                    'ids_received':self.ids_received()})
+
+    def start_sample(self):
+        # the cars come and go, then the sinks start the next sample.
+        self.sample += 1
+        if self.churn or self.cache_tree:
+            # the connected tree is found once; the departures only take subtrees out of it
+            connected = TreeIndex(self.connected_nodes())
+            if self.churn:
+                self.apply_churn(connected)
+            if self.cache_tree:
+                self.repair_free_nodes(connected)
+        self.sample_start = self.time
+        self.sample_transmissions = self.transmissions()
+        self.done_sinks = set()
+        for sink in self.sinks:
+            sink.start_sample()
+        if self.scheduler:
+            self.scheduler.restart()
+
+    def apply_churn(self,connected):
+        # each car leaves with probability churn, and as many arrive at random places in the lot.
+        # connected is the TreeIndex of the nodes connected to a sink, kept up to date.
+        stream = self.churn_random
+        sinks = set(self.topology.sinks)
+        leaving = [node_id for node_id in range(len(self.topology))
+                   if node_id not in sinks and node_id not in self.departed and stream.random() < self.churn]
+        self.medium.unregister_nodes(leaving)
+        for node_id in leaving:
+            self.car_leaves(node_id,connected)
+        (x,y) = (self.topology.x,self.topology.y)
+        (min_x,max_x,min_y,max_y) = (min(x),max(x),min(y),max(y))
+        self.cars_arrive([(min_x + stream.random() * (max_x - min_x),min_y + stream.random() * (max_y - min_y))
+                          for node_id in leaving])
+
+    def car_leaves(self,node_id,connected):
+        # a car leaves the lot (between samples; apply_churn takes it out of the medium). Its parent
+        # forgets it, and each of its children rejoins the tree with its subtree through the nearest
+        # connected tree node in range, which will annex free nodes in the next sample. A child with no
+        # such node is freed along with its own children (which try the same), so that the subtree
+        # can't be cut off from the sinks.
+        node = self.node_by_id(node_id)
+        self.departed.add(node_id)
+        if self.scheduler:
+            self.scheduler.remove_node(node_id)
+        if node is None:
+            # it was never made: nothing else knows about it
+            return
+        index = bisect.bisect_left(self.node_ids,node_id)
+        del self.node_ids[index]
+        del self.nodes[index]
+        self.departed_transmissions += node.network_interface.transmissions
+        parent = self.node_by_id(node.parent_id) if node.parent_id is not None else None
+        if parent:
+            if node_id in parent.tree_child_ids:
+                parent.tree_child_ids.remove(node_id)
+            parent.network_interface.forget(node_id)
+        # the car's subtree is no longer connected
+        subtree = [node]
+        for each in subtree:
+            connected.remove(each)
+            subtree.extend(self.tree_children(each))
+        orphans = self.tree_children(node)
+        while orphans:
+            orphan = orphans.pop()
+            orphan.network_interface.forget(orphan.parent_id)
+            orphan.orphan()
+            if not self.repair_near(orphan.x,orphan.y,connected):
+                orphans.extend(self.tree_children(orphan))
+                orphan.tree_child_ids = []
+                orphan.needs_repair = True
+
+    def cars_arrive(self,positions):
+        # cars park at the given (x,y) positions (between samples). They're free nodes, and the
+        # tree node nearest each one will annex free nodes in the next sample. returns the new nodes.
+        node_ids = [self.topology.add_node(x,y) for (x,y) in positions]
+        self.medium.register_nodes([NodeRecord(node_id,x,y,self.radius) for (node_id,(x,y)) in zip(node_ids,positions)])
+        nodes = [self.create_node(node_id) for node_id in node_ids]
+        tree_nodes = TreeIndex([node for node in [self.sink] + self.nodes if node.parent_id is not None or node.i_am_the_data_sink])
+        for node in nodes:
+            if self.scheduler:
+                self.scheduler.add_node(node,(1,node.id))
+            self.repair_near(node.x,node.y,tree_nodes)
+        return nodes
+
+    def repair_free_nodes(self,connected):
+        # the cars that missed the annexing broadcasts (or lost their parent) get another chance
+        # through the connected tree nodes (a TreeIndex)
+        for node in self.nodes:
+            if node.parent_id is None and not node.i_am_the_data_sink:
+                self.repair_near(node.x,node.y,connected)
+
+    def tree_children(self,node):
+        # the nodes in a node's cached subtree that still have it as their parent
+        children = [self.node_by_id(child_id) for child_id in node.tree_child_ids]
+        return [child for child in children if child and child.parent_id == node.id]
+
+    def connected_nodes(self):
+        # the nodes whose cached tree reaches a sink
+        connected = []
+        nodes = list(self.sinks)
+        while nodes:
+            node = nodes.pop()
+            connected.append(node)
+            nodes.extend(self.tree_children(node))
+        return connected
+
+    def repair_near(self,x,y,tree_nodes):
+        # the nearest tree node (of a TreeIndex) in range of a free car has to annex free nodes again.
+        # returns False if there's none.
+        nearest = None
+        for node in tree_nodes.near(x,y):
+            if node.parent_id is not None or node.i_am_the_data_sink:
+                distance = (node.x - x)**2 + (node.y - y)**2
+                if distance <= node.radius**2 and (nearest is None or distance < nearest[0]):
+                    nearest = (distance,node)
+        if nearest:
+            nearest[1].needs_repair = True
+        return nearest is not None
+
+    def node_stats(self):
+        # each node's MAC statistics (see MultipleAccess.stats) over the trial so far, by label
+        return dict((node.label,node.network_interface.stats(self.time)) for node in [self.sink] + self.nodes)
+
+    def ids_received(self):
+        # the number of node ids that reached the sinks
+        return sum(sink.ids_received() for sink in self.sinks)
+
+    def step(self):
+        # simulate up to the next time step (the event scheduler may skip some). Returns True when the sinks have the data.
+        if self.scheduler:
+            output = self.scheduler.step()
+            self.time = self.scheduler.time
+        else:
+            self.time += 1
+            self.event_log.set_time(self.time)
+            # parking lot node updates
+            if self.sink.update():
+                self.done_sinks.add(self.sink.id)
+            for node in self.nodes:
+                if node.update() and node.i_am_the_data_sink:
+                    self.done_sinks.add(node.id)
+            if self.mac:
+                self.mac.update()
+            self.medium.update()
+            if self.lazy_nodes:
+                self.create_receiving_nodes()
+            output = len(self.done_sinks) == len(self.sinks)
+        if output:
+            self.end_sample()
+            if self.sample < self.samples:
+                self.start_sample()
+                output = False
+        if output:
+            self.finished = True
+            self.event_log.end_trial(self.time,self.ids_received())
+        return output
+
+    def run(self,observer=None,profiler=None,max_steps=None,stop_at=None):
+        # simulate until the sinks have the data, and return the number of time steps.
+        # With stop_at, pause (returning None) once that time step has been simulated.
+        if observer:
+            observer.start(self.sink,self.nodes)
+        if profiler:
+            profiler.start(self.medium,self.sink,self.nodes)
+        while not self.finished:
+            if stop_at is not None and self.time >= stop_at:
+                return None
+            self.step()
+            if observer:
+                observer.update(self.time)
+            if profiler:
+                profiler.sample(self.time)
+            if self.finished:
+                break
+            if max_steps is not None and self.time >= max_steps:
+                raise Exception("the trial didn't finish within " + str(max_steps) + " time steps")
+        return self.time
+
+
+def run_experiment(trials=30,output_file='output.txt',use_vector_medium=False,use_event_scheduler=False,observer=None,seed=None,
+                   event_log=None,occupancy=.62,lot_size=10,topology=None,lazy_nodes=True):
+    # run a number of trials, logging every trial to the output file
+    # (or to the given event log, e.g. a BinaryEventLog).
+    # Each trial's lot is a lot_size x lot_size grid lot, or made by the topology generator.
+    if seed is not None:
+        random.seed(seed)
+    if event_log is None:
+        event_log = TextEventLog(output_file)   # clears the file
+    try:
+        for each in range(trials):
+            print each
+            run_trial(event_log,use_vector_medium,use_event_scheduler,observer,
+                      occupancy=occupancy,lot_size=lot_size,topology=topology,lazy_nodes=lazy_nodes)
+    finally:
+        event_log.close()
+
+
+if __name__ == '__main__':
+    run_experiment()
@@ -19,13 +19,15 @@ This class simulates the physical medium employed in wireless information transm
 
 The "tables" are (basically) of the following form:
 
-signals
+signals (Signal records, with __slots__)
     signal_id
     source_x
     source_y
     radius
     time
     packet
+    node_ids   (the nodes in range, found once when the signal is propagated)
+    channel    (the packet's channel)
     
 nodes
     node_id
@@ -37,110 +39,231 @@ signals_to_nodes
     node_id
     signal_id
     collision
+    channel
+
+Each table is a dict keyed by its id(s) (signal_node_pairs by (signal_id,node_id)),
+with the pairs also indexed by node id and by signal id, so that a lookup or a
+listen() costs the same no matter how large the tables grow.
+
+Collisions are tracked incrementally: each node has a count of the signals in its
+range, which changes only when a signal's pairs are created or the signal dies out.
+A node whose count goes above 1 is marked crowded, and only crowded nodes have their
+pairs flagged, so a time step costs in proportion to the signals that start and end
+in it, not to the number of nodes (or of signals in flight).
+
+There can be several channels (see Packet.channel). Signals on different channels
+don't collide, and a node listens on one channel at a time (listen(node_id,channel)),
+so the counts are kept per node and channel.
+
+A uniform grid over the node positions (cells one transmission radius wide)
+lets a signal find the nodes in its range once, when it is propagated,
+instead of testing every node against every signal on every time step.
     
 '''
+import math
+from collections import OrderedDict
+from Phy import Phy
+
+
+class Signal(object):
+    # a record in the signals table
+    __slots__ = ('id','packet','node_id','source_x','source_y','radius','time','paired','node_ids','channel')
+
+    def __init__(self,signal_id,packet,node_id,source_x,source_y,radius,time):
+        self.id = signal_id
+        self.packet = packet                # the packet is shared, not copied: packets are immutable.
+        self.node_id = node_id              # the sender
+        self.source_x = source_x
+        self.source_y = source_y
+        self.radius = radius
+        self.time = time
+        self.paired = False                 # whether the signal/node pairs have been recorded yet.
+        self.node_ids = []                  # the nodes in range
+        self.channel = packet.channel       # signals only collide with, and are only heard on, their own channel
+
+    def __repr__(self):
+        return 'Signal(' + ', '.join([name + '=' + repr(getattr(self,name)) for name in self.__slots__]) + ')'
 
 
 class Medium:
-    def __init__(self):
-        self.signals = []               # current signals in the medium
-        self.nodes = []                 # current nodes in the meduim
-        self.signal_node_pairs = []     # signal/node pairs: a signal and a node that both exists at the same physical point.
+    def __init__(self,phy=None):
+        self.phy = phy or Phy()                 # times the signals (see Phy.py)
+        self.airtime = 0                        # the time steps of airtime of all the signals propagated so far
+        self.signals = OrderedDict()            # current signals in the medium: signal_id -> signal
+        self.nodes = OrderedDict()              # current nodes in the meduim: node_id -> node
+        self.signal_node_pairs = {}             # signal/node pairs: a signal and a node that both exists at the same physical point.
+                                                # (signal_id,node_id) -> pair
+        self.pairs_by_node_id = {}              # node_id -> {signal_id: pair}, only for nodes with signals in range
+        self.pairs_by_signal_id = {}            # signal_id -> {node_id: pair}
+        self.signal_counts = {}                 # (node_id,channel) -> the number of signals on the channel in range, only where there are any
+        self.new_signals = []                   # signals propagated since the last update, not yet paired
+        self.crowded_node_ids = []              # (node_id,channel) of the nodes that got a second (or later) signal in range
+                                                # on the channel since record_collisions
         self.signal_id_counter = 0
         self.signal_node_pair_id_counter = 0
+        self.collision_count = 0                # the number of signal/node pairs that have collided so far
+        self.grid = {}                          # spatial index: (cell_x,cell_y) -> node records in that cell
+        self.grid_cell_size = 1                 # the width of a grid cell (the largest node radius)
+        self.node_order = {}                    # node_id -> registration order, to keep range queries deterministic
 
     def connect_to_the_nodes(self,nodes):
         self.register_nodes(nodes)      # create node records
 
     def get_node_by_id(self,node_id):
-        nodes = [node for node in self.nodes if node['id'] == node_id]
-        if len(nodes) == 1:
-            return nodes[0]
+        if node_id in self.nodes:
+            return self.nodes[node_id]
         else:
             raise Exception("Zero or multiple nodes have that ID")
 
     def get_signal_by_id(self,signal_id):
-        signals = [signal for signal in self.signals if signal['id'] == signal_id]
-        if len(signals) == 1:
-            return signals[0]
+        if signal_id in self.signals:
+            return self.signals[signal_id]
         else:
             raise Exception("Zero or multiple signals have that ID")
 
     def get_signal_node_pair_by_both_ids(self,signal_id,node_id):
-        pairs = [pair for pair in self.signal_node_pairs if pair['signal_id'] == signal_id and pair['node_id'] == node_id]
-        if len(pairs) > 1:
-            raise Exception("Zero or multiple signal/node pairs have those IDs")
-        elif len(pairs) == 1:
-            return pairs[0]
-        else:
-            return None
+        return self.signal_node_pairs.get((signal_id,node_id))
 
     def get_signal_node_pairs_by_node_id(self,node_id):
-        return [pair for pair in self.signal_node_pairs if pair['node_id'] == node_id]
-        
+        pairs = self.pairs_by_node_id.get(node_id)
+        if pairs:
+            return pairs.values()
+        else:
+            return []
+
+    def add_signal_node_pair(self,signal_id,node_id,channel=0):
+        # record a pair in the table and in both indexes.
+        pair = {'signal_id':signal_id,'node_id':node_id,'collision':False,'id':self.signal_node_pair_id_counter,'channel':channel}
+        self.signal_node_pair_id_counter += 1
+        self.signal_node_pairs[(signal_id,node_id)] = pair
+        self.pairs_by_node_id.setdefault(node_id,{})[signal_id] = pair
+        self.pairs_by_signal_id.setdefault(signal_id,{})[node_id] = pair
+        key = (node_id,channel)
+        count = self.signal_counts.get(key,0) + 1
+        self.signal_counts[key] = count
+        if count == 2:
+            self.crowded_node_ids.append(key)
+        elif count > 2:
+            # the node's other pairs are flagged already, just this one is new.
+            self.flag_collision(pair)
+        return pair
+
     def delete_signal_node_pairs_by_signal_id(self,signal_id):
-        self.signal_node_pairs = [pair for pair in self.signal_node_pairs if pair['signal_id'] != signal_id]
+        for (node_id,pair) in self.pairs_by_signal_id.pop(signal_id,{}).items():
+            del self.signal_node_pairs[(signal_id,node_id)]
+            node_pairs = self.pairs_by_node_id[node_id]
+            del node_pairs[signal_id]
+            if not node_pairs:
+                del self.pairs_by_node_id[node_id]
+            key = (node_id,pair['channel'])
+            if self.signal_counts[key] == 1:
+                del self.signal_counts[key]
+            else:
+                self.signal_counts[key] -= 1
         
     def register_nodes(self,nodes):
         # initially register all nodes.
         for node in nodes:
-            self.nodes.append({'id':node.id,'x':node.x,'y':node.y,'radius':node.radius})
+            if node.id in self.nodes:
+                raise Exception("Zero or multiple nodes have that ID")
+            self.nodes[node.id] = {'id':node.id,'x':node.x,'y':node.y,'radius':node.radius}
+        self.build_grid()
+
+    def unregister_nodes(self,node_ids):
+        # forget nodes (e.g. cars that left the lot): no new signal reaches them.
+        # They're taken out of their grid cells; the other nodes keep their cells and order.
+        for node_id in node_ids:
+            node = self.nodes.pop(node_id)
+            cell = self.grid_cell(node['x'],node['y'])
+            self.grid[cell].remove(node)
+            if not self.grid[cell]:
+                del self.grid[cell]
+            del self.node_order[node_id]
+
+    def grid_cell(self,x,y):
+        # the grid cell containing a point
+        return (int(math.floor(x / float(self.grid_cell_size))),int(math.floor(y / float(self.grid_cell_size))))
+
+    def build_grid(self):
+        # bucket the node records by position. The cell width is the largest
+        # transmission radius, so a range query only has to visit a few cells.
+        self.grid = {}
+        self.node_order = {}
+        self.grid_cell_size = max([node['radius'] for node in self.nodes.values()] + [1])
+        for index,node in enumerate(self.nodes.values()):
+            self.node_order[node['id']] = index
+            self.grid.setdefault(self.grid_cell(node['x'],node['y']),[]).append(node)
+
+    def get_node_ids_in_range(self,signal):
+        # use the grid to find the ids of all nodes that a signal reaches.
+        (min_x,min_y) = self.grid_cell(signal.source_x - signal.radius,signal.source_y - signal.radius)
+        (max_x,max_y) = self.grid_cell(signal.source_x + signal.radius,signal.source_y + signal.radius)
+        nodes = []
+        for cell_x in range(min_x,max_x + 1):
+            for cell_y in range(min_y,max_y + 1):
+                for node in self.grid.get((cell_x,cell_y),[]):
+                    if self.in_range(signal,node):
+                        nodes.append(node)
+        nodes.sort(key=lambda node: self.node_order[node['id']])
+        return [node['id'] for node in nodes]
         
     def propagate(self,packet):
         # propagate a signal accross the medium 
-        sender_node = self.get_node_by_id(packet['sender_id'])
-        self.signals.append({'packet':packet,
-                             'node_id':sender_node['id'],
-                             'source_x':sender_node['x'],
-                             'source_y':sender_node['y'],
-                             'radius':sender_node['radius'],
-                             'id': self.signal_id_counter,
-                             'time':4}) # propegation/receive delay. Add 1 because its decremented in the initial update.
+        sender_node = self.get_node_by_id(packet.sender_id)
+        signal = Signal(self.signal_id_counter,
+                        packet,
+                        sender_node['id'],
+                        sender_node['x'],
+                        sender_node['y'],
+                        sender_node['radius'],
+                        self.phy.airtime(packet))
+        # nodes don't move while a signal propagates, so the nodes in range are found once.
+        signal.node_ids = self.get_node_ids_in_range(signal)
+        self.airtime += signal.time
+        self.signals[signal.id] = signal
+        self.new_signals.append(signal)
         self.signal_id_counter += 1
 
     def create_signal_node_pairs(self):
-        # loop over all signals and nodes.
-        for signal in self.signals:
-            signal_id = signal['id']
-            for node in self.nodes:
-                node_id = node['id']
-                # if a signal and node are in range of eachother...
-                if self.in_range(signal,node):
-                    # check if we have recorded the fact.
-                    signal_node_pair = self.get_signal_node_pair_by_both_ids(signal_id,node_id)
-                    if not signal_node_pair:
-                        self.signal_node_pairs.append({'signal_id':signal_id,'node_id':node_id,'collision':False,'id':self.signal_node_pair_id_counter})
-                        self.signal_node_pair_id_counter += 1
+        # record a pair for each new signal and each node in its range.
+        # (the nodes in range were found when the signal was propagated)
+        for signal in self.new_signals:
+            for node_id in signal.node_ids:
+                self.add_signal_node_pair(signal.id,node_id,signal.channel)
+            signal.paired = True
+        self.new_signals = []
 
     def update_propagation_counters(self):
-        # Propagation takes 3 time steps.
+        # A signal stays in the medium for its airtime (see Phy.airtime).
         # Each signal has a counter to track it's propagation progress.
         # Signals dissapear after propagating (timers reach 0).
-        updated_signals = []
-        for signal in self.signals:
-            signal['time'] -= 1
-            if signal['time'] > 0:
-                updated_signals.append(signal)
-            else:
-                self.delete_signal_node_pairs_by_signal_id(signal['id'])
-        self.signals = updated_signals
+        for signal in self.signals.values():
+            signal.time -= 1
+            if signal.time <= 0:
+                self.delete_signal_node_pairs_by_signal_id(signal.id)
+                del self.signals[signal.id]
 
     def record_collisions(self):
         # Mark each signal/node pair according to whether the node can successfully receive the full signal.
         # If a signal collides with another signal at the location of the node, at any given time,
         # then the signal can't be received successfully.
-        for node in self.nodes:
-            pairs_in_range = self.get_signal_node_pairs_by_node_id(node['id'])
-            # if there are multiple signals at this location during this timestep: collision!
-            if pairs_in_range and len(pairs_in_range) > 1:
-                for pair in pairs_in_range:
-                    self.signal_node_pairs.remove(pair) # remove the old record.
-                    pair['collision'] = True            
-                    self.signal_node_pairs.append(pair) # add the new record.
+        # A flag stays set until its signal dies out, so only the nodes that have become
+        # crowded since the last time step need to be looked at.
+        for (node_id,channel) in self.crowded_node_ids:
+            # if there are multiple signals on a channel at this location during this timestep: collision!
+            for pair in self.pairs_by_node_id[node_id].values():
+                if pair['channel'] == channel:
+                    self.flag_collision(pair)
+        self.crowded_node_ids = []
+
+    def flag_collision(self,pair):
+        if not pair['collision']:
+            pair['collision'] = True
+            self.collision_count += 1
                                                          
     def in_range(self,signal,node):
         # determine if a signal is in range of a node
-        return (signal['source_x'] - node['x'])**2 + (signal['source_y'] - node['y'])**2 <= signal['radius']**2
+        return (signal.source_x - node['x'])**2 + (signal.source_y - node['y'])**2 <= signal.radius**2
 
     def update(self):
         self.create_signal_node_pairs()
@@ -150,39 +273,64 @@ class Medium:
         #for each in self.signals:
             #print each['packet']
 
-    def listen(self,node_id):
-        pairs_in_range = self.get_signal_node_pairs_by_node_id(node_id)
-        if pairs_in_range:
+    def listen(self,node_id,channel=0):
+        # what a node tuned to a channel hears (the other channels make no difference to it).
+        count = self.signal_counts.get((node_id,channel),0)
+        if count:
+            for pair in self.pairs_by_node_id[node_id].values():
+                if pair['channel'] == channel:
+                    break
             # If more than one signal is in range, or only one signal is in range
             # but a collision previously occured obscuring part of that packet...
-            if len(pairs_in_range) > 1 or pairs_in_range[0]['collision'] == True:
+            if count > 1 or pair['collision'] == True:
                 return 'BUSY'
             else:
             # Otherwise, there's only one signal in range and its clean and clear.
             # if the signal is finished transmitting, then return it.
             # NOTE: to simplify the model, a receiver doesnt know it's receiving a message until that message is fully transmitted.
             # So, The medium returns 'BUSY' until the message is fully transmitted.
-                signal = self.get_signal_by_id(pairs_in_range[0]['signal_id'])
-                if signal['time'] == 1:
-                    return signal['packet']
+                signal = self.get_signal_by_id(pair['signal_id'])
+                if signal.time == 1:
+                    return signal.packet
                 else:
                     return 'BUSY'
         else:
             return 'CLEAR'
                 
+    def is_idle(self):
+        # no signals in the medium, so update() has nothing to do.
+        return not self.signals
+
+    def signals_in_flight(self):
+        return len(self.signals)
+
+    def pair_count(self):
+        # the size of the signal/node pair table
+        return len(self.signal_node_pairs)
+
+    def get_receiving_node_ids(self):
+        # the ids of the nodes whose next listen() returns a packet (on the packet's channel).
+        node_ids = []
+        for signal in self.signals.values():
+            if signal.paired and signal.time == 1:
+                for node_id in signal.node_ids:
+                    if self.signal_counts[(node_id,signal.channel)] == 1 and not self.pairs_by_node_id[node_id][signal.id]['collision']:
+                        node_ids.append(node_id)
+        return node_ids
+
     def print_signal_node_pairs(self):
         # for debugging
-        for pair in self.signal_node_pairs:
+        for pair in self.signal_node_pairs.values():
             print pair
 
     def print_nodes(self):
         # for debugging
-        for node in self.nodes:
+        for node in self.nodes.values():
             print node
 
     def print_signals(self):
         # for debugging
-        for signal in self.signals:
+        for signal in self.signals.values():
             print signal
 
 
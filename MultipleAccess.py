@@ -14,18 +14,46 @@ to that node. The MultipleAccess object manages problems
 like listening to the medium, running a backoff counter,
 transmitting messages, transmitting ACKs, retransmission, etc.
 
+The CSMA parameters (p, the contention window and the ACK wait)
+are fixed unless contention policies are set (see set_policies and
+ContentionPolicy.py): they're told about every carrier sense, ACK
+and ACK timeout, and may change the parameters as they go. stats()
+has the node's transmissions, deliveries, latency and throughput.
+
 
 '''
 import random
-import copy
+from collections import deque
 from Medium2 import Medium
+from Packet import Packet, opcode
+
+# the payload of an ACK
+ACK = opcode('ACK')
 
 class MultipleAccess:
     def __init__(self,node_id):
         self._node_id = node_id             # the id of the node that owns this object/instance
         self._state = 'QUEUE_IS_EMPTY'      # the state of the FSM
-        self._incoming_queue = []           # a queue of incoming packets
-        self._outgoing_queue = []           # a queue of outgoing packets
+        self._incoming_queue = deque()      # a queue of incoming packets (enqueue on the right, dequeue on the left)
+        self._outgoing_queue = deque()      # a queue of outgoing packets (enqueue on the right, dequeue on the left)
+        self._ack_queue = deque()           # the priority lane: ACKs go out before anything in the outgoing queue
+        self._max_incoming = None           # the most packets the incoming queue may hold (None: no limit)
+        self._max_outgoing = None           # the most packets the outgoing queue may hold (None: no limit)
+        self.dropped_incoming = 0           # the number of incoming packets dropped because the queue was full
+        self.dropped_outgoing = 0           # the number of outgoing packets dropped because the queue was full
+        self.transmissions = 0              # the number of packets put on the medium
+        self.retransmissions = 0            # ... of which were re-transmissions
+        self.ack_timeouts = 0               # the number of times the ACK wait ran out
+        self.delivered = 0                  # the number of outgoing packets delivered (ACKed, or sent if no ACK is needed)
+        self.delivery_ticks = 0             # ... and the time steps they spent in the queue, all told
+        self.senses = 0                     # the number of times the medium was sensed before sending
+        self.busy_senses = 0                # ... and found busy
+        self.clock = 0                      # the number of time steps the object has been updated (or skipped) for
+        self._enqueued_at = deque()         # the clock when each packet in the outgoing queue was queued
+        self._sent_at = 0                   # the clock when the packet waiting for ACKs was sent
+        self._head_retransmitted = False    # has the packet at the front of the outgoing queue been re-transmitted?
+        self.policies = []                  # the contention policies (see ContentionPolicy.py)
+        self._head_sent = False             # has the packet at the front of the outgoing queue been sent before?
         self._incoming_ack = None           # the holder for an incoming ACK
         self._contention_window = 3         # the contention window for CSMA
         self._ack_wait = 200                # the amount of time the system should wait for expected ACKs before assuming failure.
@@ -34,61 +62,106 @@ class MultipleAccess:
         self.p = 0.05                       # the "p" in p-persistant CSMA: transmit with a probability of p.
         self._expected_acks = []            # a list of the ids of nodes from which we're expecting ACKs
         self.save = []
+        self.random = None                  # the node's random number stream (None: the random module)
+        self.channel = 0                    # the channel the node listens on (but see _listening_channel)
         self.medium = None                  # a pointer to the medium
 
     def connect_to_the_medium(self,medium):
         # point to the medium
         self.medium = medium
 
+    def set_contention_window(self,contention_window):
+        # the largest backoff counter value
+        self._contention_window = contention_window
+
+    def set_channel(self,channel):
+        # tune in to a channel. Packets are sent on their own channel (Packet.channel).
+        self.channel = channel
+
+    def set_random(self,stream):
+        # draw the random trials and backoffs from this stream (a random.Random, see RandomStreams.py)
+        self.random = stream
+
+    def set_policies(self,policies):
+        # adapt the CSMA parameters with these contention policies (see ContentionPolicy.py)
+        self.policies = list(policies)
+        for policy in self.policies:
+            policy.attach(self)
+
+    def set_queue_limits(self,max_incoming=None,max_outgoing=None):
+        # cap the queue depths. Packets that arrive at a full queue are dropped and counted.
+        # (a dropped incoming packet isn't ACKed, so its sender will retransmit it)
+        self._max_incoming = max_incoming
+        self._max_outgoing = max_outgoing
+
+    def forget(self,node_id):
+        # drop the outgoing packets to a node that has gone (e.g. a car that left the lot),
+        # so that they aren't retransmitted forever.
+        kept = [(packet,time) for (packet,time) in zip(self._outgoing_queue,self._enqueued_at) if node_id not in packet.receiver_id]
+        queue = deque(packet for (packet,time) in kept)
+        self._enqueued_at = deque(time for (packet,time) in kept)
+        if self._outgoing_queue and (not queue or queue[0] is not self._outgoing_queue[0]):
+            # the packet at the front is gone: stop waiting for its ACKs.
+            self._head_sent = False
+            self._head_retransmitted = False
+            self._expected_acks = []
+            self._ack_wait_counter = 0
+            if self._state == 'WAITING_FOR_ACK':
+                self._state = 'OUTGOING_MESSAGE_PENDING'
+        self._outgoing_queue = queue
+        if self._state != 'QUEUE_IS_EMPTY' and not self._outgoing_message_queued():
+            self._state = 'QUEUE_IS_EMPTY'
+
     #NOTE send_message is 1 of the 2 important interface methods
     #------------------------------------------------------------
     def send_message(self,message):
-        # work around a design flaw in the packet
-        if type(message['receiver_id']) == int:
-            message['receiver_id'] = [message['receiver_id']]
-        # check for errors
-        self._validate_packet(message)
+        # packets are checked when they're made (see Packet.py). Old-style dict packets are converted.
+        if not isinstance(message,Packet):
+            message = Packet.from_dict(message)
         # enqueue
-        self._outgoing_queue.insert(0,message)
+        if self._max_outgoing is not None and len(self._outgoing_queue) >= self._max_outgoing:
+            self.dropped_outgoing += 1
+            return
+        self._outgoing_queue.append(message)
+        self._enqueued_at.append(self.clock)
 
     #NOTE receive_message is 1 of the 2 important interface methods
     #--------------------------------------------------------------
     def receive_message(self):
         if self._incoming_queue:
             # dequeue
-            return self._incoming_queue.pop()
+            return self._incoming_queue.popleft()
         else:
             return None
 
+    def incoming_message_pending(self):
+        # is there a message waiting for receive_message()?
+        return len(self._incoming_queue) > 0
+
+    def outgoing_message_pending(self):
+        # is a message from send_message() still waiting to be sent (or for its ACKs)?
+        return len(self._outgoing_queue) > 0
+
+    def ack_wait(self):
+        # the time steps to wait for ACKs before re-transmitting
+        return int(self._ack_wait)
+
     def _send_high_priority_message(self,message):
-        # place a packet at the front of the queue.
+        # place a packet in the priority lane, ahead of the outgoing queue.
         # (namely for sending ACKS)
-        self._outgoing_queue.append(message)
+        self._ack_queue.append(message)
 
-    def _validate_packet(self,packet):
-        # This is not completely air-tight.
-        if 'mode' not in packet.keys():
-            raise Exception("packet missing field: mode")
-        if 'sender_id' not in packet.keys():
-            raise Exception("packet missing field: sender_id")
-        if 'receiver_id' not in packet.keys():
-            raise Exception("packet missing field: receiver_id")
-        if packet['mode'] not in ['broadcast','multicast','unicast']:
-            raise Exception("invalid mode")
-        if not type(packet['sender_id']) == str:
-            raise Exception("invalid datatype for sender_id ")
-        if packet['mode'] != 'broadcast' and packet['receiver_id'] == None:
-            raise Exception("receiver_id(s) required")
-        if type(packet['receiver_id']) != list:
-            raise Exception('receiver_id must be a list of ints')
+    def _outgoing_message_queued(self):
+        # is there anything to send, in either lane?
+        return len(self._ack_queue) > 0 or len(self._outgoing_queue) > 0
 
     def _bernoulli_trial(self):
         # p-persistant sends when the channel is clear with a probability p, using this as a trial.
-        return random.random() < self.p
+        return (self.random or random).random() < self.p
 
     def _set_backoff_counter(self):
         # if the medium is busy, set the back off counter and wait for it to run out.
-        self._backoff_counter = random.randint(0,self._contention_window)
+        self._backoff_counter = (self.random or random).randint(0,self._contention_window)
 
     def _set_ack_wait_counter(self):
         # This timer places a limit on how long we should wait for an ACK before retransmitting. 
@@ -96,12 +169,26 @@ class MultipleAccess:
 
     def _is_a_packet(self,sample):
         # determine if what we've received over the network is a packet.
-        # (Packets are dictionaries. Busy and clear signals are strings)
-        return type(sample) == dict
+        # (Busy and clear signals are strings)
+        return isinstance(sample,Packet)
 
-    def _listen(self):
+    def _listening_channel(self):
+        # while waiting for an ACK, the node listens on the channel the packet went out on.
+        if self._state == 'WAITING_FOR_ACK':
+            return self._outgoing_queue[0].channel
+        return self.channel
+
+    def _next_packet(self):
+        # the packet that goes out next: ACKs first.
+        if self._ack_queue:
+            return self._ack_queue[0]
+        return self._outgoing_queue[0]
+
+    def _listen(self,channel=None):
         # The medium's listen method will return either 'BUSY', 'CLEAR', or an actual packet.
-        return self.medium.listen(self._node_id)
+        if channel is None:
+            channel = self._listening_channel()
+        return self.medium.listen(self._node_id,channel)
 
     def _transmit(self,packet):
         # ..the packet becomes a signal...
@@ -111,55 +198,87 @@ class MultipleAccess:
     def _save_receiver_ids(self, packet):
         # In the case of a multicast or unicast, save the receiver
         # id(s) from a sent packet so that we know who should be sending ACKs.
-        self._expected_acks = packet['receiver_id']
+        self._expected_acks = list(packet.receiver_id)
 
 
     def _is_for_me(self,packet):
         # determine if a packet is intended for me
-        if packet['mode'] == 'broadcast' and packet['sender_id'] != self._node_id:
+        if packet.mode == 'broadcast' and packet.sender_id != self._node_id:
             return True
-        elif self._node_id in packet['receiver_id']:
+        elif self._node_id in packet.receiver_id:
             return True
         else:
             return False
 
     def _requires_ack(self,packet):
         # Determine if the sender of a packet we've received requires an ACK
-        return not packet['mode'] == 'broadcast' and not packet['payload'] == 'ACK'
+        return not packet.mode == 'broadcast' and not packet.payload == ACK
 
-    def _make_ack(self,receiver_id):
+    def _make_ack(self,receiver_id,channel=0):
         # Create an ACK packet for a given receiver.
-        return {'sender_id':self._node_id,                  # sender id (the node that owns this multiple access instance)
-                'receiver_id':[receiver_id],                # the id(s) of the receiver(s)
-                'payload':'ACK',                            # the message/payload
-                'mode':'unicast'}                           # the mode (broadcast, multicast, unicast)
+        return Packet(self._node_id,                        # sender id (the node that owns this multiple access instance)
+                      (receiver_id,),                       # the id(s) of the receiver(s)
+                      ACK,                                  # the message/payload
+                      'unicast',                            # the mode (broadcast, multicast, unicast)
+                      None,
+                      channel)                              # the channel the packet being ACKed came on
+
+    def _count_transmission(self,lane):
+        # keep count of transmissions, and of re-transmissions of the same outgoing packet.
+        self.transmissions += 1
+        if lane is self._outgoing_queue:
+            if self._head_sent:
+                self.retransmissions += 1
+                self._head_retransmitted = True
+            self._head_sent = True
+
+    def _dequeue(self,lane):
+        # remove a sent packet from the front of its lane
+        lane.popleft()
+        if lane is self._outgoing_queue:
+            self._head_sent = False
+            self._head_retransmitted = False
+            self.delivered += 1
+            self.delivery_ticks += self.clock - self._enqueued_at.popleft()
 
     def _outgoing_message_pending(self):
         # STATE: outgoing message pending
         if self._backoff_counter == 0:                              # if the backoff counter has run out...
-            medium_sample = self._listen()                          # ... then listen to the medium.
+            medium_sample = self._listen(self._next_packet().channel)   # ... then listen to the medium (on the packet's channel).
+            self._sensed(medium_sample != 'CLEAR')
             if medium_sample == 'CLEAR':                            # if the medium is clear...
                 if self._bernoulli_trial():                         # ... then perform a random trial
-                    packet = self._outgoing_queue[-1]               # take the next message from the queue. But dont dequeue, incase we need to re-transmit later.
-                    self._transmit(packet)                          # if the random trial is successful, then send!
-                    if self._requires_ack(packet):                  # if the transmission was a multicast or unicast and not an ack...
-                        self._save_receiver_ids(packet)             # ... make note of who should be sending ACKs.
-                        self._set_ack_wait_counter()
-                        self._state = 'WAITING_FOR_ACK'             # ... then wait for the ACK
-                    else:
-                        self._outgoing_queue.pop()
-                        if not self._outgoing_queue:                # Otherwise, if the queue is empty... 
-                            self._state = 'QUEUE_IS_EMPTY'          # ... then just wait.
+                    self._send_next_packet()                        # if the random trial is successful, then send!
             else:
                 self._set_backoff_counter()                         # ... otherwise, set the backoff counter and keep waiting.
         else:
             self._backoff_counter -= 1                              # ... keep counting down the backoff counter.
+
+    def _send_next_packet(self):
+        # transmit the packet at the front of the queue (the random trial was successful).
+        if self._ack_queue:                                         # ACKs go first.
+            lane = self._ack_queue
+        else:
+            lane = self._outgoing_queue
+        packet = lane[0]                                            # take the next message from the queue. But dont dequeue, incase we need to re-transmit later.
+        self._transmit(packet)
+        self._count_transmission(lane)
+        if self._requires_ack(packet):                              # if the transmission was a multicast or unicast and not an ack...
+            self._save_receiver_ids(packet)                         # ... make note of who should be sending ACKs.
+            self._incoming_ack = None                               # ... an ACK already in the holder is a late one, for an earlier packet.
+            self._sent_at = self.clock
+            self._set_ack_wait_counter()
+            self._state = 'WAITING_FOR_ACK'                         # ... then wait for the ACK
+        else:
+            self._dequeue(lane)
+            if not self._outgoing_message_queued():                 # Otherwise, if the queue is empty... 
+                self._state = 'QUEUE_IS_EMPTY'                      # ... then just wait.
     '''
     def _waiting_for_ack(self):
         if self._ack_wait_counter != 0:
             if self._expected_acks:                                 # if we're expecting ACKs... 
                 if self._incoming_ack:                              # if there's an incoming ACK...
-                    sender_id = self._incoming_ack['sender_id']         
+                    sender_id = self._incoming_ack.sender_id         
                     if sender_id in self._expected_acks:            # if the incoming ack is one of the ones we've been expecting...
                         self._expected_acks.remove(sender_id)       # ... we needn't wait for that ACK anymore.
                         self._incoming_ack = None                   # ... clear the ACK holder.
@@ -182,22 +301,37 @@ class MultipleAccess:
         # STATE: waiting for ACK
         if self._expected_acks and self._ack_wait_counter != 0:     # we're expecting ACKs and time hasn't run out.
             if self._incoming_ack:
-                sender_id = self._incoming_ack['sender_id']
+                sender_id = self._incoming_ack.sender_id
                 if sender_id in self._expected_acks:
                     self._expected_acks.remove(sender_id)
                     self._incoming_ack = None
             self._ack_wait_counter -= 1
         elif self._expected_acks and self._ack_wait_counter == 0:   # we're expecting ACKs but time has run out.
+            self.ack_timeouts += 1
             self._expected_acks = []
             self._state = 'OUTGOING_MESSAGE_PENDING'
+            for policy in self.policies:
+                policy.timed_out(self)
         elif not self._expected_acks:                               # we're expecting no more ACKS and time doesn't matter.
             self._ack_wait_counter = 0
-            self._outgoing_queue.pop()
-            if self._outgoing_queue:
+            # the round trip, unless the packet was re-transmitted (then the ACK may be for an earlier copy)
+            round_trip = None if self._head_retransmitted else self.clock - self._sent_at
+            for policy in self.policies:
+                policy.acked(self,round_trip)
+            self._dequeue(self._outgoing_queue)                     # dequeue that message because it was received.
+            if self._outgoing_message_queued():
                 self._state = 'OUTGOING_MESSAGE_PENDING'
             else:
                 self._state = 'QUEUE_IS_EMPTY'
 
+    def _sensed(self,busy):
+        # the medium was sensed before sending
+        self.senses += 1
+        if busy:
+            self.busy_senses += 1
+        for policy in self.policies:
+            policy.sensed(self,busy)
+
     def _undefined_state(self):
         raise Exception('undefined state!')
 
@@ -205,19 +339,22 @@ class MultipleAccess:
         medium_sample = self._listen()
         if self._is_a_packet(medium_sample):
             if self._is_for_me(medium_sample):
-                packet = copy.deepcopy(medium_sample)
-                if packet['payload'] == 'ACK':
+                packet = medium_sample                      # packets are immutable, so there's no need to copy it.
+                if packet.payload == ACK:
                     self._incoming_ack = packet
                 else:
+                    if self._max_incoming is not None and len(self._incoming_queue) >= self._max_incoming:
+                        self.dropped_incoming += 1                  # no room: drop it without an ACK.
+                        return
                     if self._requires_ack(packet):
-                        ack_packet = self._make_ack(packet['sender_id'])
+                        ack_packet = self._make_ack(packet.sender_id,packet.channel)
                         self._send_high_priority_message(ack_packet)
-                    self._incoming_queue.insert(0,packet) 
+                    self._incoming_queue.append(packet)
 
     def _handle_outgoing_packets(self):
         if self._state == 'QUEUE_IS_EMPTY':
             # check if there's a packet in the outgoing queue.
-            if self._outgoing_queue:
+            if self._outgoing_message_queued():
                 self._state = 'OUTGOING_MESSAGE_PENDING'
                 
         elif self._state == 'OUTGOING_MESSAGE_PENDING':
@@ -230,11 +367,57 @@ class MultipleAccess:
             self._undefined_state()
         
     def update(self):
+        self.clock += 1
         # Receive any incoming messages
         self._handle_incoming_packets()
         # Send any outgoing messages (this is the state machine).
         self._handle_outgoing_packets()
 
+    def idle_ticks(self):
+        # The number of coming updates that would only count down a counter,
+        # assuming no packet arrives for this node in the meantime.
+        # None means the FSM stays idle until a packet arrives.
+        if self._state == 'QUEUE_IS_EMPTY':
+            if self._outgoing_message_queued():
+                return 0
+            return None
+        elif self._state == 'OUTGOING_MESSAGE_PENDING':
+            return self._backoff_counter
+        elif self._state == 'WAITING_FOR_ACK':
+            if not self._expected_acks or self._ack_wait_counter == 0:
+                return 0
+            if self._incoming_ack and self._incoming_ack.sender_id in self._expected_acks:
+                return 0
+            return self._ack_wait_counter
+        else:
+            return 0
+
+    def skip(self,ticks):
+        # Fast-forward over updates that would only count down (see idle_ticks).
+        self.clock += ticks
+        if self._state == 'OUTGOING_MESSAGE_PENDING':
+            self._backoff_counter -= ticks
+        elif self._state == 'WAITING_FOR_ACK' and self._expected_acks:
+            self._ack_wait_counter -= ticks
+
+    def stats(self,time=None):
+        # the node's MAC statistics: its counters, the mean time steps from queueing to delivery
+        # (latency), the packets delivered per time step over the given time (throughput; over its
+        # own clock if None), the fraction of carrier senses that found the medium busy, and the
+        # CSMA parameters it ended with.
+        if time is None:
+            time = self.clock
+        return {'transmissions':self.transmissions,
+                'retransmissions':self.retransmissions,
+                'ack_timeouts':self.ack_timeouts,
+                'delivered':self.delivered,
+                'latency':self.delivery_ticks / float(self.delivered) if self.delivered else None,
+                'throughput':self.delivered / float(time) if time else 0.0,
+                'busy_fraction':self.busy_senses / float(self.senses) if self.senses else None,
+                'p':float(self.p),
+                'contention_window':int(self._contention_window),
+                'ack_wait':int(self._ack_wait)}
+
     def print_info(self):
         print "node_id: ", self._node_id
         print "state: ", self._state
@@ -245,8 +428,15 @@ class MultipleAccess:
         print "ack_wait_counter: ", self._ack_wait_counter
         print "p: ", self.p
         print "expected_acks: ", self._expected_acks
+        print "dropped_incoming: ", self.dropped_incoming
+        print "dropped_outgoing: ", self.dropped_outgoing
+        print "transmissions: ", self.transmissions
+        print "retransmissions: ", self.retransmissions
+        print "ack_timeouts: ", self.ack_timeouts
         for each in self._incoming_queue:
             print "incoming_queue: ", each
+        for each in self._ack_queue:
+            print "ack_queue: ", each
         for each in self._outgoing_queue:
             print "outgoing_queue: ", each
 
@@ -13,27 +13,22 @@ data aggregation.
 """
 
 from MultipleAccess import MultipleAccess
+from Packet import Packet, opcode, encode_varint, decode_varint, with_arguments, split_arguments
 from Medium2 import Medium
-import sys, pygame
+import math
+import sys
 import random
 import time
 
-# colors for pygame
-BLACK =  (  0,   0,   0)
-WHITE =  (255, 255, 255)
-BLUE =   (  0,   0, 255)
-GREEN =  (  0, 255,   0)
-RED =    (255,   0,   0)
-YELLOW = (255, 255,   0)
-
 
 class Node:
     
     # protocol messages:
-    ANNEX_FREE_NODES = "If you have no parent node yet, then I am your parent node." # broadcast
-    ACK_OF_PARENT = "I am your child node."                                          # unicast
-    GROW_COMMAND = "Annex any free nodes."                                           # unicast
-    DATA_TO_PARENT = "DATA"                                                          # unicast: "DATA,233,44,234,12,456"  
+    ANNEX_FREE_NODES = opcode("If you have no parent node yet, then I am your parent node.") # broadcast
+    ACK_OF_PARENT = opcode("I am your child node.")                                          # unicast
+    GROW_COMMAND = opcode("Annex any free nodes.")                                           # unicast
+    RELEASE_CHILD = opcode("I am not your parent node.")                                     # unicast (see release_late_reply)
+    DATA_TO_PARENT = "DATA"                                                                  # unicast: "DATA" + the number of ids + the ids, as varints (see Packet.py)
 
     # states
     WAIT_TO_BE_ANNEXED = 1
@@ -41,10 +36,22 @@ class Node:
     GROW = 3
     SEND_GROW_COMMANDS = 4
     DO_NOTHING = 5
+
+    # the channel that free nodes listen on, for the annexing broadcasts and their ACK_OF_PARENT replies
+    CONTROL_CHANNEL = 0
+
+    # positions are sent (in ACK_OF_PARENT, with concurrent_grow) in these fractions of a space
+    POSITION_SCALE = 8
     
-    def __init__(self,x,y,node_id):
-        # unique identifier
+    def __init__(self,x,y,node_id,label=None):
+        # unique identifier: a non-negative int (e.g. from a Topology). Ids are sent as
+        # varints (see Packet.py) and pick the data channels (see data_channel), so a
+        # name like '3_4' belongs in the label.
+        if type(node_id) not in (int,long) or node_id < 0:
+            raise Exception("a node id must be a non-negative int, not " + repr(node_id))
         self.id = node_id
+        # the name the event logs know the node by
+        self.label = label if label is not None else str(node_id)
         # physical position
         self.x = x
         self.y = y
@@ -52,6 +59,9 @@ class Node:
         self.radius = 2
         # access to the network
         self.network_interface = MultipleAccess(node_id)
+        # the number of channels in the lot. A node collects its children's data on
+        # its own channel (see data_channel), so sibling subtrees can use different ones.
+        self.channels = 1
         # pointers
         self.parent_id = None
         self.child_ids = []
@@ -61,21 +71,39 @@ class Node:
         self.timer = 0
         # a timeout value for listening for responses to the grow broadcast.
         self.grow_timeout = 750 # timesteps
+        # end the window early, once no response has come for a quiet period (see quiet_period)
+        # scaled by this factor. None: always wait out the grow_timeout.
+        self.grow_quiet_factor = None
+        self.quiet_timer = 0
         # a timeout value for listening for a data response from a child. 
         self.child_response_timeout = 99999999999 #timesteps
         # save the id of thie child node from whom we're currently expecting a data response
         self.selected_child = None
-        # data received from child nodes
-        self.received_data = ''
+        # command several children at once (see command_separated_children): the children
+        # commanded and not heard from yet, the positions the children sent, and how far apart
+        # the children commanded at once must be (the radius if None)
+        self.concurrent_grow = False
+        self.commanded_ids = []
+        self.child_positions = {}
+        self.child_separation = None
+        # data received from child nodes: the ids, as the varint strings they came in, and how many there are
+        self.received_data = []
+        self.received_count = 0
         # sample id
         self.sample_id = None
+        # keep the tree between samples (see start_sample): the children annexed so far, and
+        # whether the node has to annex free nodes again (no tree yet, or a car nearby came or went)
+        self.cache_tree = False
+        self.tree_child_ids = []
+        self.needs_repair = True
         # is this the data sink node?
         self.i_am_the_data_sink = False
         # screen positions
-        self.screen_position = ((self.x + 1)*80,(self.y + 2)*50)
-        self.parent_screen_position = None
+        self.screen_position = (int((self.x + 1)*80),int((self.y + 2)*50))
         # a file pointer to log data
         self.output_file = None
+        # a buffered event log (see EventLog.py), used instead of the output file if set
+        self.event_log = None
 
     def set_as_sink(self):
         # set this node to be the data sink node.
@@ -83,110 +111,234 @@ class Node:
         self.sample_id = 1
         self.grow_enter()
 
+    def start_sample(self):
+        # start the sink's next sampling round. With a cached tree, the GROW_COMMANDs go
+        # straight down it, and only the nodes that need repair annex free nodes again.
+        self.sample_id += 1
+        self.received_data = []
+        self.received_count = 0
+        self.grow_or_command()
+
+    def grow_or_command(self):
+        if self.cache_tree and not self.needs_repair:
+            self.child_ids = list(self.tree_child_ids)
+            self.send_grow_commands_enter()
+        else:
+            self.grow_enter()
+
     def set_output_file(self,output_file):
         # set the file pointer
         self.output_file = output_file
 
+    def set_event_log(self,event_log):
+        # log events to a buffered event log rather than appending to the output file
+        self.event_log = event_log
+
     def ids_sent(self):
-        # there's an extra comma in the ids string.
-        return 'ids_sent_' + str(self.received_data.count(',') + 1)
+        # the ids received, and this node's own id.
+        return 'ids_sent_' + str(self.received_count + 1)
+
+    def ids_received(self):
+        # the number of node ids received from child nodes.
+        return self.received_count
 
     def log_event(self,event):
-        if self.output_file:
+        if self.event_log:
+            self.event_log.log(self.label,event)
+        elif self.output_file:
             with open(self.output_file,'a') as fp:
-                fp.write(self.id + '\t' + event + '\n')
+                fp.write(self.label + '\t' + event + '\n')
     
     def set_parent_id(self,parent_id):
         self.parent_id = parent_id
-        [x,y] = map(int, parent_id.split('_'))
-        self.parent_screen_position = ((x + 1)*80,(y + 2)*50)
 
     def connect_to_the_medium(self,medium):
         # this is one part of the bidirectional pointer between the node and the medium.
         self.network_interface.connect_to_the_medium(medium)
 
     def save_data(self,payload):
-        # save the node ids recieved from a child node.
-        data = payload.replace('DATA','')
-        self.received_data += data
+        # save the node ids recieved from a child node. They're kept encoded, to be joined once when sent on.
+        (count,offset) = decode_varint(payload,len(Node.DATA_TO_PARENT))
+        self.received_data.append(payload[offset:])
+        self.received_count += count
+
+    def data_channel(self,node_id):
+        # the channel a node sends GROW_COMMANDs and collects DATA on (statically per subtree)
+        if self.channels == 1:
+            return 0
+        return node_id % self.channels
+
+    def tune(self,channel):
+        # listen on a channel
+        self.network_interface.set_channel(channel)
 
     def send_data_to_parent(self):
-        data = 'DATA' + self.received_data + ',' + str(self.id)
-        message = {'sender_id':self.id,'receiver_id':[self.parent_id],'payload':data,'mode':'unicast'}
+        data = Node.DATA_TO_PARENT + encode_varint(self.received_count + 1) + ''.join(self.received_data) + encode_varint(self.id)
+        message = Packet(self.id,(self.parent_id,),data,'unicast',None,self.data_channel(self.parent_id))
         self.network_interface.send_message(message)
         self.log_event(self.ids_sent())
         
     def wait_to_be_annexed_do(self,message):
         # listen for the broadcast from a leaf node. 
-        if message and message['payload'] == Node.ANNEX_FREE_NODES and message['sample_id'] != self.sample_id:
-            self.wait_to_be_annexed_exit(message['sender_id'],message['sample_id'])
+        if message and message.payload == Node.ANNEX_FREE_NODES and message.sample_id != self.sample_id:
+            self.wait_to_be_annexed_exit(message.sender_id,message.sample_id)
+        elif self.grow_quiet_factor is not None:
+            self.release_late_reply(message)
 
     def wait_to_be_annexed_exit(self,parent_id,sample_id):
         # remeber what sampling this is to prevent double sampling
         self.sample_id = sample_id
         # become the broadcasting node's child.
         self.set_parent_id(parent_id)
-        # send an acknowledgement to the broadcasting node.
-        message = {'sender_id':self.id,'receiver_id':[self.parent_id],'payload':Node.ACK_OF_PARENT,'mode':'unicast'}
+        # send an acknowledgement to the broadcasting node (with this node's position, for concurrent growth).
+        payload = Node.ACK_OF_PARENT
+        if self.concurrent_grow:
+            payload = with_arguments(payload,[int(round(self.x * Node.POSITION_SCALE)),int(round(self.y * Node.POSITION_SCALE))])
+        message = Packet(self.id,(self.parent_id,),payload,'unicast')
         self.network_interface.send_message(message)
         self.log_event('ack_of_parent')
         # state transition
         self.state = Node.WAIT_FOR_GROW_COMMAND
+        self.tune(self.data_channel(self.parent_id))
 
     def wait_for_grow_command_do(self,message):
-        if message and message['sender_id'] == self.parent_id and message['payload'] == Node.GROW_COMMAND:
-            self.grow_enter()
+        if message and message.sender_id == self.parent_id and message.payload == Node.GROW_COMMAND:
+            self.sample_id = message.sample_id
+            self.grow_or_command()
+        elif message and message.sender_id == self.parent_id and message.payload == Node.RELEASE_CHILD:
+            # the parent had sent its data before this node's reply got through: be free again,
+            # to be annexed by another node in this sample
+            self.sample_id = None
+            self.orphan()
+        elif self.grow_quiet_factor is not None and self.cache_tree:
+            # a reply that came after the node sent its data: the child is commanded in the next sample
+            self.annex_late_reply(message)
             
     def grow_enter(self):
         self.state = Node.GROW
+        self.tune(Node.CONTROL_CHANNEL)
+        if self.cache_tree:
+            # a repair: the children already in the tree stay
+            self.child_ids = list(self.tree_child_ids)
         # broadcast to free nodes
-        message = {'sender_id':self.id,'receiver_id':[],'payload':Node.ANNEX_FREE_NODES,'mode':'broadcast','sample_id':self.sample_id}
+        message = Packet(self.id,(),Node.ANNEX_FREE_NODES,'broadcast',self.sample_id)
         self.network_interface.send_message(message)
         self.log_event('broadcast')
         # limit the window of time to listen for responses.
         self.timer = self.grow_timeout
-        
+        if self.grow_quiet_factor is not None:
+            self.quiet_timer = self.quiet_period()
+
+    def quiet_period(self):
+        # How long to wait for another ACK_OF_PARENT before ending the GROW window early.
+        # A reply that collided is sent again once the child's ACK wait runs out, and the
+        # free nodes around contend for the channel for about 1/p time steps each; the more
+        # that have replied, the more are likely still waiting to get through.
+        mac = self.network_interface
+        contention = self.grow_quiet_factor * (len(self.child_ids) + 1) / float(mac.p)
+        return mac.ack_wait() + int(math.ceil(contention))
+
+    def quiet(self):
+        # is the quiet period counting down? (it starts once the broadcast is out)
+        return self.grow_quiet_factor is not None and not self.network_interface.outgoing_message_pending()
+
     def grow_do(self,message):
         # listen for responses to the broadcast, establishing that the senders are this node's children.
-        if message and message['payload'] == Node.ACK_OF_PARENT and message['mode'] == 'unicast':
-            if message['sender_id'] not in self.child_ids:
-                self.child_ids.append(message['sender_id'])
+        replied = message and message.payload.startswith(Node.ACK_OF_PARENT) and message.mode == 'unicast'
+        if replied:
+            if message.sender_id not in self.child_ids:
+                self.child_ids.append(message.sender_id)
+            (payload,position) = split_arguments(message.payload)
+            if position:
+                self.child_positions[message.sender_id] = (position[0] / float(Node.POSITION_SCALE),position[1] / float(Node.POSITION_SCALE))
         # keep counting down
         self.timer -= 1
-        if self.timer == 0:
+        if self.grow_quiet_factor is not None:
+            if replied or not self.quiet():
+                self.quiet_timer = self.quiet_period()
+            else:
+                self.quiet_timer -= 1
+        if self.timer == 0 or (self.quiet() and self.quiet_timer == 0):
             # exit state
             self.grow_exit()
 
+    def annex_late_reply(self,message):
+        # A reply to the broadcast that came after an early end of the GROW window: its sender
+        # thinks it's this node's child, so take it on (it's commanded after the others).
+        if message and message.payload.startswith(Node.ACK_OF_PARENT) and message.mode == 'unicast':
+            if message.sender_id not in self.child_ids:
+                self.child_ids.insert(0,message.sender_id)
+            if self.cache_tree and message.sender_id not in self.tree_child_ids:
+                self.tree_child_ids.append(message.sender_id)
+
+    def release_late_reply(self,message):
+        # A reply to the broadcast that came after the node ended a GROW window with no children
+        # and sent its data: its sender would wait for a GROW_COMMAND forever, so let it go.
+        if message and message.payload.startswith(Node.ACK_OF_PARENT) and message.mode == 'unicast':
+            message = Packet(self.id,(message.sender_id,),Node.RELEASE_CHILD,'unicast',None,self.data_channel(self.id))
+            self.network_interface.send_message(message)
+
     def grow_exit(self):
+        if self.cache_tree:
+            self.tree_child_ids = list(self.child_ids)
+            self.needs_repair = False
         if self.child_ids:
             self.send_grow_commands_enter()
         else:
             self.send_data_to_parent()
-            self.state = Node.WAIT_TO_BE_ANNEXED
-            self.parent_id = None
+            self.finish_sample()
 
     def send_grow_commands_enter(self):
         # send a command to each of the child nodes instructing them to annex free nodes.
         self.state = Node.SEND_GROW_COMMANDS
+        self.tune(self.data_channel(self.id))
         # the ids should be in random order already.
-        if self.child_ids:
+        if self.concurrent_grow and self.child_ids:
+            self.command_separated_children()
+        elif self.child_ids:
             self.selected_child = self.child_ids[-1]
-            message = {'sender_id':self.id,'receiver_id':[self.selected_child],'payload':Node.GROW_COMMAND,'mode':'unicast'}
+            message = Packet(self.id,(self.selected_child,),Node.GROW_COMMAND,'unicast',self.sample_id,self.data_channel(self.id))
             self.network_interface.send_message(message)
             self.log_event('grow_command')
             self.timer = self.child_response_timeout
         else:
             self.send_grow_commands_exit()
 
+    def command_separated_children(self):
+        # command every child that's out of range of the children already growing their subtrees,
+        # so that the subtrees grow, and send their data, at the same time. A child that didn't
+        # send its position waits for the others to finish.
+        for child_id in reversed(self.child_ids):
+            if child_id not in self.commanded_ids and all(self.separated(child_id,other) for other in self.commanded_ids):
+                message = Packet(self.id,(child_id,),Node.GROW_COMMAND,'unicast',self.sample_id,self.data_channel(self.id))
+                self.network_interface.send_message(message)
+                self.log_event('grow_command')
+                self.commanded_ids.append(child_id)
+        self.timer = self.child_response_timeout
+
+    def separated(self,child_id,other_id):
+        # are two children far enough apart to grow their subtrees at once?
+        if child_id not in self.child_positions or other_id not in self.child_positions:
+            return False
+        ((x1,y1),(x2,y2)) = (self.child_positions[child_id],self.child_positions[other_id])
+        separation = self.child_separation if self.child_separation is not None else self.radius
+        return (x1 - x2)**2 + (y1 - y2)**2 > separation**2
+
     def send_grow_commands_do(self,message=None):
-        # listen for the data response from each child node
-        if message and message['payload'].startswith(Node.DATA_TO_PARENT) and message['sender_id'] == self.selected_child:
-            self.save_data(message['payload'])
-            self.child_ids.remove(self.selected_child)
+        # listen for the data response from each child node (or each commanded child, with concurrent growth)
+        if self.grow_quiet_factor is not None:
+            self.annex_late_reply(message)
+        if (message and message.payload.startswith(Node.DATA_TO_PARENT) and
+            (message.sender_id == self.selected_child or message.sender_id in self.commanded_ids)):
+            self.save_data(message.payload)
+            self.child_ids.remove(message.sender_id)
+            if message.sender_id in self.commanded_ids:
+                self.commanded_ids.remove(message.sender_id)
             self.send_grow_commands_exit()
         self.timer -= 1
         if self.timer == 0:
-            # exit state
+            # exit state (commanding the children again)
+            self.commanded_ids = []
             self.send_grow_commands_exit()
 
     def send_grow_commands_exit(self):
@@ -200,19 +352,36 @@ class Node:
             else:
                 # otherwise, send the accumulated data to the parent node.
                 self.send_data_to_parent()
-                # reset
-                self.timer = 0
-                self.selected_child = None
-                self.parent_id = None
-                self.received_data = ''
-                self.state = Node.WAIT_TO_BE_ANNEXED
+                self.finish_sample()
+
+    def finish_sample(self):
+        # reset, once the data has gone to the parent node. Without a cached tree the node
+        # is free again; with one it waits for its parent's GROW_COMMAND in the next sample.
+        self.timer = 0
+        self.selected_child = None
+        self.commanded_ids = []
+        self.received_data = []
+        self.received_count = 0
+        if self.cache_tree:
+            self.state = Node.WAIT_FOR_GROW_COMMAND
+            self.tune(self.data_channel(self.parent_id))
+        else:
+            self.parent_id = None
+            self.state = Node.WAIT_TO_BE_ANNEXED
+            self.tune(Node.CONTROL_CHANNEL)
+
+    def orphan(self):
+        # the parent node has gone: be free to be annexed again (keeping any cached children).
+        self.parent_id = None
+        self.state = Node.WAIT_TO_BE_ANNEXED
+        self.tune(Node.CONTROL_CHANNEL)
             
     def handle_stray_ack_of_parenthood(self,message):
         #
         #
-        if message and message['payload'] == Node.ACK_OF_PARENT and message['mode'] == 'unicast':
+        if message and message.payload.startswith(Node.ACK_OF_PARENT) and message.mode == 'unicast':
             if self.child_id: 
-                self.child_ids.insert(0,message['sender_id'])
+                self.child_ids.insert(0,message.sender_id)
                 
     def update(self):
         # listen to the network
@@ -233,45 +402,28 @@ class Node:
         # update the multiple access machine
         self.network_interface.update()
 
-
-    def render(self,screen):
-        # Draw the node. The color depends on the state.
-        if self.state == Node.WAIT_TO_BE_ANNEXED:
-            color = BLUE
-        elif self.state == Node.WAIT_FOR_GROW_COMMAND:
-            color = YELLOW
-        elif self.state == Node.GROW:
-            color = GREEN
-        elif self.state == Node.SEND_GROW_COMMANDS:
-            color = RED
-        else:
-            color = WHITE
-        pygame.draw.circle(screen, color, self.screen_position, 10, 0)
-
-
-class Edges:
-    #
-    # This class was a last minute fix to the problem
-    # of drawing edges between nodes. For each time step, you
-    # have to loop over all the nodes, calling record_edge(node)
-    # on each node. Then, to render the edges on the screen,
-    # just call render().
-    # 
-    def __init__(self,screen):
-        self.edges = []
-        self.screen = screen
-
-    def record_edge(self,node):
-        if node.parent_id:
-            self.edges.append([node.screen_position,node.parent_screen_position])
-
-    def reset(self):
-        self.edges = []
-
-    def _render_edge(self,edge):
-        pygame.draw.line(self.screen, WHITE, edge[0], edge[1], 1)
-
-    def render(self,screen):
-        map(self._render_edge,self.edges)
-
-
+    def idle_ticks(self):
+        # The number of coming updates that would only count down timers,
+        # assuming no packet arrives for this node in the meantime.
+        # None means the node stays idle until a packet arrives.
+        if self.state == Node.DO_NOTHING or self.network_interface.incoming_message_pending():
+            return 0
+        ticks = self.network_interface.idle_ticks()
+        if self.state == Node.GROW or self.state == Node.SEND_GROW_COMMANDS:
+            # the update that takes the timer to 0 exits the state.
+            if ticks is None or self.timer - 1 < ticks:
+                ticks = self.timer - 1
+        if self.state == Node.GROW and self.quiet() and self.quiet_timer - 1 < ticks:
+            ticks = self.quiet_timer - 1
+        return ticks
+
+    def skip(self,ticks):
+        # Fast-forward over updates that would only count down timers (see idle_ticks).
+        if self.state == Node.DO_NOTHING:
+            # the tick loop doesn't update a finished sink's MAC either
+            return
+        if self.state == Node.GROW or self.state == Node.SEND_GROW_COMMANDS:
+            self.timer -= ticks
+        if self.state == Node.GROW and self.quiet():
+            self.quiet_timer -= ticks
+        self.network_interface.skip(ticks)
@@ -0,0 +1,199 @@
+"""
+
+Online Statistics
+-----------------
+
+Aggregates the results of any number of trials as they happen, in bounded memory,
+so that a sweep over millions of trials never has to keep (or write) its event logs.
+
+RunningStats    count, mean, variance, min and max of a stream of numbers (Welford's method)
+P2Quantile      an estimate of one quantile of a stream of numbers, from five markers
+                (the P-square algorithm of Jain and Chlamtac)
+StatsEventLog   an event log (see EventLog.py) that keeps statistics instead of the events:
+                    completion time     the time step at which the sink got the data
+                                        (mean, variance, quantiles)
+                    coverage            the fraction of the lot's node ids that reached the sink
+                    messages            the number of events logged per trial
+                    per node            the number of each event per node, summed over trials
+                                        (keyed by node label, so bounded by the lot size)
+                Trials that never end (e.g. given up after max_steps) are counted as unfinished.
+
+To aggregate in one process, pass a StatsEventLog to run_trial/run_experiment in place of a
+file. Worker processes can return each trial's record (StatsEventLog.record) instead, for the
+parent to add_trial() to its own StatsEventLog (see ParallelRunner.stream_trials).
+
+
+"""
+
+
+from EventLog import EventLog, EVENT_CODES, parse_event
+import json
+
+# the events counted per node, in the order of their counts
+EVENTS = sorted(EVENT_CODES.keys(),key=lambda name: EVENT_CODES[name])
+
+
+class RunningStats:
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0                   # the sum of squared differences from the mean
+        self.min = None
+        self.max = None
+
+    def add(self,x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / float(self.count)
+        self.m2 += delta * (x - self.mean)
+        if self.min is None or x < self.min:
+            self.min = x
+        if self.max is None or x > self.max:
+            self.max = x
+
+    def variance(self):
+        # the sample variance
+        if self.count < 2:
+            return 0.0
+        return self.m2 / (self.count - 1)
+
+    def summary(self):
+        return {'count':self.count,'mean':self.mean,'variance':self.variance(),'min':self.min,'max':self.max}
+
+
+class P2Quantile:
+    def __init__(self,q):
+        self.q = q
+        self.heights = []                                   # the marker heights (the first five observations, to start)
+        self.positions = [1,2,3,4,5]                        # the marker positions
+        self.desired = [1,1 + 2 * q,1 + 4 * q,3 + 2 * q,5]  # the desired marker positions
+        self.increments = [0,q / 2.0,q,(1 + q) / 2.0,1]
+
+    def add(self,x):
+        heights = self.heights
+        if len(heights) < 5:
+            heights.append(float(x))
+            heights.sort()
+            return
+        # find the cell x falls in, stretching the extreme markers if need be
+        if x < heights[0]:
+            heights[0] = float(x)
+            cell = 0
+        elif x >= heights[4]:
+            heights[4] = float(x)
+            cell = 3
+        else:
+            cell = 0
+            while x >= heights[cell + 1]:
+                cell += 1
+        for i in range(cell + 1,5):
+            self.positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        # move the middle markers toward their desired positions
+        positions = self.positions
+        for i in range(1,4):
+            d = self.desired[i] - positions[i]
+            if (d >= 1 and positions[i + 1] - positions[i] > 1) or (d <= -1 and positions[i - 1] - positions[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self.parabolic(i,d)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = self.linear(i,d)
+                heights[i] = height
+                positions[i] += d
+
+    def parabolic(self,i,d):
+        (h,n) = (self.heights,self.positions)
+        return h[i] + d / float(n[i + 1] - n[i - 1]) * ((n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / float(n[i + 1] - n[i]) +
+                                                         (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / float(n[i] - n[i - 1]))
+
+    def linear(self,i,d):
+        (h,n) = (self.heights,self.positions)
+        return h[i] + d * (h[i + d] - h[i]) / float(n[i + d] - n[i])
+
+    def value(self):
+        if not self.heights:
+            return None
+        if len(self.heights) < 5:
+            # too few observations for the markers: the exact quantile
+            return self.heights[int(round(self.q * (len(self.heights) - 1)))]
+        return self.heights[2]
+
+
+class StatsEventLog(EventLog):
+    def __init__(self,quantiles=[0.5,0.9,0.99]):
+        EventLog.__init__(self,capacity=1)
+        self.completion_time = RunningStats()
+        self.quantiles = [P2Quantile(q) for q in quantiles]
+        self.coverage = RunningStats()
+        self.messages = RunningStats()
+        self.node_events = {}           # node label -> the number of each event (in EVENTS order), over all trials
+        self.finished = 0
+        self.unfinished = 0
+        self.current = None             # the counts of the trial in progress
+        self.record = None              # the record of the last trial that ended
+
+    def start_trial(self,node_count):
+        if self.current is not None:
+            self.unfinished += 1        # the last trial never ended
+        self.trial += 1
+        self.time = 0
+        self.current = {'node_count':node_count,'events':{}}
+
+    def log(self,node_id,event):
+        # count the event (nothing is kept but the counts)
+        counts = self.current['events'].get(node_id)
+        if counts is None:
+            counts = self.current['events'][node_id] = [0] * len(EVENTS)
+        counts[EVENT_CODES[parse_event(event)[0]] - 1] += 1
+
+    def end_trial(self,time,ids_received):
+        record = self.current
+        self.current = None
+        record['time'] = time
+        record['ids_received'] = ids_received
+        self.record = record
+        self.add_trial(record)
+
+    def add_trial(self,record):
+        # add a trial's record: its node count, completion time, ids received and events per node
+        # (None for a trial that didn't finish).
+        if record is None:
+            self.unfinished += 1
+            return
+        self.finished += 1
+        self.completion_time.add(record['time'])
+        for quantile in self.quantiles:
+            quantile.add(record['time'])
+        if record['node_count']:
+            self.coverage.add(record['ids_received'] / float(record['node_count']))
+        messages = 0
+        for (node_id,counts) in record['events'].items():
+            totals = self.node_events.get(node_id)
+            if totals is None:
+                totals = self.node_events[node_id] = [0] * len(EVENTS)
+            for i in range(len(EVENTS)):
+                totals[i] += counts[i]
+            messages += sum(counts)
+        self.messages.add(messages)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.current is not None:
+            self.unfinished += 1
+            self.current = None
+
+    def summary(self):
+        return {'finished':self.finished,
+                'unfinished':self.unfinished,
+                'completion_time':self.completion_time.summary(),
+                'completion_time_quantiles':dict((str(quantile.q),quantile.value()) for quantile in self.quantiles),
+                'coverage':self.coverage.summary(),
+                'messages':self.messages.summary(),
+                'node_events':dict((node_id,dict(zip(EVENTS,counts))) for (node_id,counts) in self.node_events.items())}
+
+    def write_summary(self,path):
+        with open(path,'w') as f:
+            json.dump(self.summary(),f,indent=1,sort_keys=True)
@@ -0,0 +1,138 @@
+'''
+The Packet Class
+----------------
+
+The packets that nodes send each other through MultipleAccess and the Medium.
+
+A packet is an immutable named tuple, so it's compact, and a packet can be
+handed to every node that receives it without being copied. It's checked
+once, when it's made:
+
+sender_id       the id of the sending node (a non-negative int, see Node.id)
+receiver_id     the ids of the receiving nodes (a tuple; a single id is accepted too)
+payload         the message
+mode            'broadcast', 'multicast' or 'unicast'
+sample_id       the sampling the packet belongs to (ANNEX_FREE_NODES broadcasts only)
+channel         the channel it's sent on (0 unless the lot uses several, see Node.channels)
+
+For code written against the old dict packets, packet['payload'] still works.
+
+A packet's length is the size of its payload as it would be sent: the protocol's
+fixed messages (registered with opcode()) are sent as a one byte opcode, anything
+else as its bytes. The medium takes longer to carry long packets (see Phy.py).
+
+Lists of node ids (the aggregated data) are sent as varints: 7 bits per byte,
+low bits first, with the top bit set on every byte but the last. An id below
+128 takes one byte, one below 16384 two. A fixed message can carry numbers too
+(see with_arguments): its opcode is followed by the numbers as varints.
+
+'''
+from collections import namedtuple
+
+# the protocol's fixed messages, each sent as a one byte opcode
+OPCODES = {}
+# separates a fixed message from its arguments in a payload (see with_arguments)
+ARGUMENTS = '\0'
+
+
+def opcode(message):
+    # register a fixed protocol message. returns the message.
+    if message not in OPCODES:
+        if len(OPCODES) == 256:
+            raise Exception("out of opcodes")
+        OPCODES[message] = len(OPCODES)
+    return message
+
+
+class Packet(namedtuple('Packet',['sender_id','receiver_id','payload','mode','sample_id','channel'])):
+    __slots__ = ()
+
+    def __new__(cls,sender_id,receiver_id,payload,mode,sample_id=None,channel=0):
+        # work around a design flaw in the packet: a single receiver id is allowed.
+        if type(receiver_id) == int or type(receiver_id) == str:
+            receiver_id = (receiver_id,)
+        elif type(receiver_id) == list:
+            receiver_id = tuple(receiver_id)
+        # check for errors (this is not completely air-tight).
+        if mode not in ['broadcast','multicast','unicast']:
+            raise Exception("invalid mode")
+        if not type(sender_id) == str and not type(sender_id) == int:
+            raise Exception("invalid datatype for sender_id ")
+        if mode != 'broadcast' and receiver_id == None:
+            raise Exception("receiver_id(s) required")
+        if type(receiver_id) != tuple:
+            raise Exception('receiver_id must be a list of ints')
+        return super(Packet,cls).__new__(cls,sender_id,receiver_id,payload,mode,sample_id,channel)
+
+    @classmethod
+    def from_dict(cls,message):
+        # make a packet from an old-style dict packet
+        for field in ['mode','sender_id','receiver_id']:
+            if field not in message:
+                raise Exception("packet missing field: " + field)
+        return cls(message['sender_id'],message['receiver_id'],message.get('payload'),message['mode'],message.get('sample_id'),
+                   message.get('channel',0))
+
+    def __getitem__(self,key):
+        # dict-style access by field name, e.g. packet['payload']
+        if isinstance(key,str):
+            return getattr(self,key)
+        return tuple.__getitem__(self,key)
+
+    def length(self):
+        # the packet's payload length in bytes, as sent
+        if self.payload is None:
+            return 0
+        if self.payload in OPCODES:
+            return 1
+        (message,separator,arguments) = self.payload.partition(ARGUMENTS)
+        if separator and message in OPCODES:
+            return 1 + len(arguments)
+        return len(self.payload)
+
+
+def encode_varint(number):
+    # a non-negative int as a varint (a str of bytes)
+    if number < 0:
+        raise Exception('only non-negative ints can be encoded')
+    data = []
+    while number > 127:
+        data.append(chr(number & 127 | 128))
+        number >>= 7
+    data.append(chr(number))
+    return ''.join(data)
+
+
+def decode_varint(data,offset=0):
+    # the varint at data[offset:]. returns (the int, the offset after it).
+    number = 0
+    shift = 0
+    while True:
+        byte = ord(data[offset])
+        offset += 1
+        number |= (byte & 127) << shift
+        if byte < 128:
+            return (number,offset)
+        shift += 7
+
+
+def decode_varints(data,offset=0):
+    # all of the varints from data[offset:], as a list
+    numbers = []
+    while offset < len(data):
+        (number,offset) = decode_varint(data,offset)
+        numbers.append(number)
+    return numbers
+
+
+def with_arguments(message,numbers):
+    # a fixed message followed by non-negative ints (sent as its opcode, then the ints as varints)
+    return message + ARGUMENTS + ''.join(encode_varint(number) for number in numbers)
+
+
+def split_arguments(payload):
+    # (the fixed message, its arguments) of a payload made by with_arguments, or (payload,[])
+    (message,separator,arguments) = payload.partition(ARGUMENTS)
+    if separator and message in OPCODES:
+        return (message,decode_varints(arguments))
+    return (payload,[])
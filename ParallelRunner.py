@@ -0,0 +1,173 @@
+"""
+
+Parallel Runner Script
+-----------------
+
+Runs independent trials, and sweeps over p, contention_window, radius and
+occupancy, across all cores with a process pool:
+python ParallelRunner.py [trials] [seed]
+
+Every trial gets its own seed, drawn from the master seed in trial order, so
+a trial's result doesn't depend on which worker runs it or when. The same
+trial index gets the same seed at every point of a sweep, so the points are
+compared on the same random lots (where the occupancy is the same).
+
+Workers don't touch the shared output file. Each one logs its trial to a
+private temporary file and returns the log to the parent along with the
+result, and the parent writes the logs to the output file in trial order.
+
+For sweeps too big to keep the logs of, stream_trials keeps online statistics
+instead (see OnlineStats.py): each worker returns only its trial's record, and
+the parent adds the records to one StatsEventLog per sweep point in trial order
+(so the floating point sums don't depend on which worker finishes first).
+
+The event scheduler is used by default: it gives the same results as the
+time step loop, much faster. Some lots never finish (e.g. when no node is in
+range of the sink, the sink retransmits its DATA forever), so every trial is
+given up after max_steps time steps. A trial that is given up, or that fails
+in any other way, has its exception recorded as the result's 'error' and its
+'steps' left as None.
+
+
+"""
+
+
+from Experiment import run_trial
+from OnlineStats import StatsEventLog
+import multiprocessing
+import itertools
+import tempfile
+import random
+import sys
+import os
+
+# give up on a trial after this many time steps (a 10x10 lot normally finishes in about 50000)
+MAX_STEPS = 1000000
+
+
+def trial_seeds(seed,trials):
+    # a deterministic seed for each trial
+    rng = random.Random(seed)
+    return [rng.randint(0,2**31 - 1) for each in range(trials)]
+
+
+def sweep_points(sweep):
+    # every combination of the swept parameter values, e.g.
+    # {'p':[0.05,0.1],'radius':[2,3]} -> [{'p':0.05,'radius':2},{'p':0.05,'radius':3},...]
+    names = sorted(sweep.keys())
+    return [dict(zip(names,values)) for values in itertools.product(*[sweep[name] for name in names])]
+
+
+def point_key(parameters):
+    # a sweep point as a dict key
+    return tuple(sorted(parameters.items()))
+
+
+def run_task(task):
+    # run one trial in a worker process and return its result.
+    (trial,seed,parameters,options) = task
+    (handle,log_file) = tempfile.mkstemp(suffix='.txt')
+    os.close(handle)
+    result = {'trial':trial,'seed':seed,'parameters':parameters,'steps':None,'error':None}
+    try:
+        keywords = dict(parameters)
+        keywords.update(options)
+        result['steps'] = run_trial(log_file,seed=seed,**keywords)
+    except Exception as e:
+        result['error'] = str(e)
+    with open(log_file) as f:
+        result['log'] = f.read()
+    os.remove(log_file)
+    return result
+
+
+def run_stats_task(task):
+    # run one trial in a worker process, keeping only its statistics record.
+    (trial,seed,parameters,options) = task
+    result = {'trial':trial,'seed':seed,'parameters':parameters,'steps':None,'error':None,'record':None}
+    event_log = StatsEventLog()
+    try:
+        keywords = dict(parameters)
+        keywords.update(options)
+        result['steps'] = run_trial(event_log,seed=seed,**keywords)
+        result['record'] = event_log.record
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+
+def run_tasks(tasks,processes=None):
+    # run tasks across a pool of worker processes (or in this one, if processes == 1).
+    if processes == 1:
+        return [run_task(task) for task in tasks]
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(run_task,tasks,chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def run_trials(trials=30,seed=0,parameters={},processes=None,use_vector_medium=False,use_event_scheduler=True,
+               max_steps=MAX_STEPS):
+    # run a number of independent trials. returns their results in trial order.
+    options = {'use_vector_medium':use_vector_medium,'use_event_scheduler':use_event_scheduler,'max_steps':max_steps}
+    tasks = [(trial,trial_seed,parameters,options) for (trial,trial_seed) in enumerate(trial_seeds(seed,trials))]
+    return run_tasks(tasks,processes)
+
+
+def run_sweep(sweep,trials=30,seed=0,processes=None,use_vector_medium=False,use_event_scheduler=True,
+              max_steps=MAX_STEPS):
+    # run a number of trials at every point of a parameter sweep (see sweep_points).
+    # returns the results, point by point, in trial order.
+    options = {'use_vector_medium':use_vector_medium,'use_event_scheduler':use_event_scheduler,'max_steps':max_steps}
+    tasks = []
+    for parameters in sweep_points(sweep):
+        for (trial,trial_seed) in enumerate(trial_seeds(seed,trials)):
+            tasks.append((trial,trial_seed,parameters,options))
+    return run_tasks(tasks,processes)
+
+
+def stream_trials(trials=30,seed=0,sweep={},processes=None,use_vector_medium=False,use_event_scheduler=True,
+                  max_steps=MAX_STEPS,chunksize=16):
+    # run a number of trials at every point of a sweep (just one point with an empty sweep),
+    # aggregating the results in trial order as they come in. returns [(parameters, StatsEventLog)], point by point.
+    options = {'use_vector_medium':use_vector_medium,'use_event_scheduler':use_event_scheduler,'max_steps':max_steps}
+    points = sweep_points(sweep)
+    stats = dict((point_key(parameters),StatsEventLog()) for parameters in points)
+    def tasks():
+        # generated as the pool takes them, so they're never all in memory
+        # (the seeds are the same as trial_seeds')
+        for parameters in points:
+            rng = random.Random(seed)
+            for trial in range(trials):
+                yield (trial,rng.randint(0,2**31 - 1),parameters,options)
+    if processes == 1:
+        results = itertools.imap(run_stats_task,tasks())
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap(run_stats_task,tasks(),chunksize)
+    try:
+        for result in results:
+            stats[point_key(result['parameters'])].add_trial(result['record'])
+    finally:
+        if processes != 1:
+            pool.close()
+            pool.join()
+    return [(parameters,stats[point_key(parameters)]) for parameters in points]
+
+
+def write_output(results,output_file):
+    # write the trials' logs to one output file, in the same format as Experiment.py.
+    with open(output_file,'w') as f:
+        for result in results:
+            f.write(result['log'])
+
+
+if __name__ == '__main__':
+    trials = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    results = run_trials(trials,seed)
+    write_output(results,'output.txt')
+    for result in results:
+        print result['trial'], result['seed'], result['steps'], result['error'] or ''
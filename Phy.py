@@ -0,0 +1,43 @@
+"""
+
+Phy Class
+---------
+
+The physical layer model the mediums use to time signals. A signal stays in the
+medium (where it can be heard by listen() and collide with other signals) for
+its airtime:
+
+    airtime = delay + the time steps needed to send the packet's bits (rounded up)
+
+where the packet's bits are its header and its encoded payload (see
+Packet.length: a protocol message is a one byte opcode, DATA is varints), and
+
+    bitrate         bits sent per time step
+    header_bytes    the bytes every packet carries besides its payload
+                    (addresses, mode, sample id, checksum)
+    delay           the propagation/receive delay, in time steps. Add 1 because a
+                    signal's time is decremented in the medium's initial update.
+
+The defaults give every protocol message and ACK the 4 time steps that every
+packet used to take, and DATA packets one more time step per 32 bytes of ids
+beyond the first 24. To model a slower or faster radio, pass a Phy to the medium
+(or phy=... to Experiment.run_trial).
+
+"""
+
+
+class Phy:
+    def __init__(self,bitrate=256,header_bytes=8,delay=3):
+        if bitrate <= 0:
+            raise Exception("the bitrate must be positive")
+        self.bitrate = bitrate
+        self.header_bytes = header_bytes
+        self.delay = delay
+
+    def bits(self,packet):
+        # the bits sent for a packet
+        return (self.header_bytes + packet.length()) * 8
+
+    def airtime(self,packet):
+        # the time steps a packet occupies the channel for
+        return self.delay + (self.bits(packet) + self.bitrate - 1) // self.bitrate
@@ -0,0 +1,166 @@
+"""
+
+Profiler Class
+--------------
+
+Finds out where a trial spends its time. A Profiler times the phases of a
+time step, and samples a few hot-path counters after every simulated time step:
+
+phases (time and number of calls)
+    Node            wait_to_be_annexed_do, wait_for_grow_command_do, grow_do,
+                    send_grow_commands_do (the state handlers)
+    MultipleAccess  _handle_incoming_packets, _handle_outgoing_packets
+                    (and VectorMultipleAccess's, which call MultipleAccess's for some nodes)
+    Medium          create_signal_node_pairs, record_collisions,
+                    update_propagation_counters (Medium2 and VectorMedium)
+
+counters (one row of the time series per sampled time step)
+    signals         signals in flight
+    pairs           the size of the signal/node pair table
+    collisions      signal/node pairs that collided in the time step
+    retransmissions packets sent again because they weren't ACKed
+    ack_timeouts    ACK waits that ran out
+    airtime         time steps of airtime of the signals propagated in the time step
+                    (see Phy.py); its total over the trial's time is the channel load
+
+The phases are timed by wrapping the methods of those classes, and only while
+a profiler is enabled, so a trial run without one costs nothing extra. Only
+one profiler can be enabled at a time. To profile a trial:
+
+    profiler = Profiler()
+    run_trial('output.txt',profiler=profiler)
+    profiler.write_summary('profile.json')
+    profiler.write_series('profile.csv')
+
+
+"""
+
+
+from Node import Node
+from MultipleAccess import MultipleAccess
+from Medium2 import Medium
+from timeit import default_timer
+import json
+
+# the timed phases: class -> method names
+PHASES = [(Node,['wait_to_be_annexed_do','wait_for_grow_command_do','grow_do','send_grow_commands_do']),
+          (MultipleAccess,['_handle_incoming_packets','_handle_outgoing_packets']),
+          (Medium,['create_signal_node_pairs','record_collisions','update_propagation_counters'])]
+
+# the columns of the time series
+COUNTERS = ['signals','pairs','collisions','retransmissions','ack_timeouts','airtime']
+
+
+def phase_classes():
+    # the classes with timed phases (VectorMedium and VectorMultipleAccess only if NumPy is there)
+    phases = list(PHASES)
+    try:
+        from VectorMedium import VectorMedium
+        from VectorMultipleAccess import VectorMultipleAccess
+        phases.append((VectorMedium,['create_signal_node_pairs','record_collisions','update_propagation_counters']))
+        phases.append((VectorMultipleAccess,['_handle_incoming_packets','_handle_outgoing_packets']))
+    except ImportError:
+        pass
+    return phases
+
+
+class Profiler:
+    enabled = None                      # the profiler whose wrappers are installed, if any
+
+    def __init__(self):
+        self.calls = {}                 # phase -> number of calls
+        self.seconds = {}               # phase -> total time
+        self.series = []                # [time step] + COUNTERS, per sampled time step
+        self.totals = dict((counter,0) for counter in COUNTERS[2:])
+        self._last = {}                 # the cumulative counters at the last sample
+        self._originals = []
+
+    def enable(self):
+        # install the timing wrappers
+        if Profiler.enabled is not None:
+            raise Exception('another profiler is enabled')
+        Profiler.enabled = self
+        for (cls,names) in phase_classes():
+            for name in names:
+                phase = cls.__name__ + '.' + name
+                self.calls.setdefault(phase,0)
+                self.seconds.setdefault(phase,0.0)
+                self._originals.append((cls,name,cls.__dict__[name]))
+                setattr(cls,name,self._wrap(phase,cls.__dict__[name]))
+
+    def disable(self):
+        # put the original methods back
+        for (cls,name,method) in self._originals:
+            setattr(cls,name,method)
+        self._originals = []
+        if Profiler.enabled is self:
+            Profiler.enabled = None
+
+    def _wrap(self,phase,method):
+        calls = self.calls
+        seconds = self.seconds
+        def timed(*args,**kwargs):
+            start = default_timer()
+            try:
+                return method(*args,**kwargs)
+            finally:
+                seconds[phase] += default_timer() - start
+                calls[phase] += 1
+        timed.__name__ = method.__name__
+        return timed
+
+    def start(self,medium,sink,nodes):
+        # a new trial. nodes is the trial's list of nodes, which may grow as nodes are made.
+        self.medium = medium
+        self.sink = sink
+        self.nodes = nodes
+        self._last = {'collisions':medium.collision_count,'retransmissions':0,'ack_timeouts':0,'airtime':medium.airtime}
+
+    def sample(self,time):
+        # record the counters after a time step
+        current = {'collisions':self.medium.collision_count,
+                   'retransmissions':self.sink.network_interface.retransmissions,
+                   'ack_timeouts':self.sink.network_interface.ack_timeouts,
+                   'airtime':self.medium.airtime}
+        for node in self.nodes:
+            current['retransmissions'] += node.network_interface.retransmissions
+            current['ack_timeouts'] += node.network_interface.ack_timeouts
+        row = [time,self.medium.signals_in_flight(),self.medium.pair_count()]
+        for counter in COUNTERS[2:]:
+            change = current[counter] - self._last[counter]
+            self.totals[counter] += change
+            row.append(change)
+        self._last = current
+        self.series.append(row)
+
+    def summary(self):
+        # the totals of a run: time and calls per phase, and the counters
+        phases = {}
+        for phase in self.calls:
+            phases[phase] = {'calls':self.calls[phase],'seconds':self.seconds[phase]}
+        result = {'phases':phases,'samples':len(self.series)}
+        result.update(self.totals)
+        if self.series:
+            result['max_signals'] = max(row[1] for row in self.series)
+            result['max_pairs'] = max(row[2] for row in self.series)
+        return result
+
+    def write_summary(self,path):
+        with open(path,'w') as f:
+            json.dump(self.summary(),f,indent=1,sort_keys=True)
+
+    def write_series(self,path):
+        # the time series as CSV
+        with open(path,'w') as f:
+            f.write(','.join(['time'] + COUNTERS) + '\n')
+            for row in self.series:
+                f.write(','.join(str(value) for value in row) + '\n')
+
+    def print_summary(self):
+        summary = self.summary()
+        for phase in sorted(summary['phases'],key=lambda phase: -self.seconds[phase]):
+            if not self.calls[phase]:
+                continue                # e.g. the medium engine that wasn't used
+            print "%-45s %10d calls %10.3f s" % (phase,self.calls[phase],self.seconds[phase])
+        for counter in COUNTERS[2:]:
+            print counter + ": ", summary[counter]
@@ -0,0 +1,45 @@
+"""
+
+Random Streams
+--------------
+
+Independent, reproducible random number streams. Every trial has a seed, and
+every part of the trial that needs random numbers (the lot, each node's
+MultipleAccess object) gets its own stream, seeded from the trial seed and the
+part's name:
+
+    lot_random(seed)            the stream the lot is generated from
+    node_random(seed,label)     a node's stream (its CSMA trials and backoffs),
+                                named by its label (see Topology.py)
+    churn_random(seed)          the cars that come and go between samples
+
+A stream depends only on the trial seed and its name, not on how many numbers
+the other streams have drawn. So the results don't depend on the order the
+nodes are updated in, and the time step loop, the event scheduler, the batched
+MAC engine and worker processes all produce the same trajectory from a seed.
+
+(The seeds are spawned by hashing, in the spirit of NumPy's SeedSequence,
+which isn't available to this code.)
+
+"""
+
+
+import hashlib
+import random
+
+
+def spawn_seed(seed,name):
+    # a seed for the stream with the given name, derived from a trial seed
+    return int(hashlib.sha1(str(seed) + '/' + str(name)).hexdigest()[:16],16)
+
+
+def lot_random(seed):
+    return random.Random(spawn_seed(seed,'lot'))
+
+
+def node_random(seed,label):
+    return random.Random(spawn_seed(seed,'node/' + str(label)))
+
+
+def churn_random(seed):
+    return random.Random(spawn_seed(seed,'churn'))
@@ -0,0 +1,110 @@
+"""
+
+Renderer Class
+--------------
+
+Draws the parking lot with pygame. A Renderer is an observer of a trial
+(see Experiment.run_trial) and can be throttled to draw every N time steps,
+since drawing on every time step caps the simulation's throughput.
+
+"""
+
+import sys, pygame
+
+# colors for pygame
+BLACK =  (  0,   0,   0)
+WHITE =  (255, 255, 255)
+BLUE =   (  0,   0, 255)
+GREEN =  (  0, 255,   0)
+RED =    (255,   0,   0)
+YELLOW = (255, 255,   0)
+
+
+class Edges:
+    #
+    # This class was a last minute fix to the problem
+    # of drawing edges between nodes. For each time step, you
+    # have to loop over all the nodes, calling record_edge(node,positions)
+    # on each node, where positions maps node ids to screen positions.
+    # Then, to render the edges on the screen, just call render().
+    #
+    def __init__(self,screen):
+        self.edges = []
+        self.screen = screen
+
+    def record_edge(self,node,positions):
+        if node.parent_id is not None and node.parent_id in positions:
+            self.edges.append([node.screen_position,positions[node.parent_id]])
+
+    def reset(self):
+        self.edges = []
+
+    def _render_edge(self,edge):
+        pygame.draw.line(self.screen, WHITE, edge[0], edge[1], 1)
+
+    def render(self,screen):
+        map(self._render_edge,self.edges)
+
+
+class Renderer:
+    def __init__(self,every=1,size=[1000,600]):
+        # Initialize the game engine
+        pygame.init()
+        self.screen = pygame.display.set_mode(size)
+        self.every = every              # draw every N time steps
+        self.next_draw = every          # the time step of the next drawing
+        self.sink = None
+        self.nodes = []
+        self.edges = Edges(self.screen)
+
+    def start(self,sink,nodes):
+        # a new trial
+        self.sink = sink
+        self.nodes = nodes
+        self.next_draw = self.every
+
+    def update(self,time):
+        # throttled on simulated time, so the event scheduler's jumps over
+        # idle time steps don't change how often the lot is drawn.
+        if time < self.next_draw:
+            return
+        self.next_draw = (time // self.every + 1) * self.every
+        # pygame inputs
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                sys.exit()
+        # record edges
+        self.edges.reset()
+        positions = {self.sink.id:self.sink.screen_position}
+        for node in self.nodes:
+            positions[node.id] = node.screen_position
+        for node in self.nodes:
+            self.edges.record_edge(node,positions)
+        # visual updates
+        self.screen.fill(BLACK)
+        self.render_building()
+        self.render_node(self.sink)
+        for node in self.nodes:
+            self.render_node(node)
+        self.edges.render(self.screen)
+        pygame.display.update()
+
+    def render_building(self):
+        pygame.draw.rect(self.screen,BLUE,(850,250,100,200),0)
+
+    def render_node(self,node):
+        # Draw the node. The color depends on the state.
+        if node.state == node.WAIT_TO_BE_ANNEXED:
+            color = BLUE
+        elif node.state == node.WAIT_FOR_GROW_COMMAND:
+            color = YELLOW
+        elif node.state == node.GROW:
+            color = GREEN
+        elif node.state == node.SEND_GROW_COMMANDS:
+            color = RED
+        else:
+            color = WHITE
+        pygame.draw.circle(self.screen, color, node.screen_position, 10, 0)
+
+    def quit(self):
+        pygame.quit()
@@ -0,0 +1,465 @@
+"""
+
+Sharded Medium
+--------------
+
+Runs one trial on several processes, for lots too big for one Medium and one
+process to keep up with. The lot is split into tiles (columns x rows over the
+bounding box of the cars and sinks), and each tile is simulated by a worker
+process with its own nodes and its own MediumShard: a Medium2.Medium that only
+pairs signals with the tile's nodes.
+
+The tiles can run side by side because a node never hears a signal in the time
+step it was sent: the medium only pairs signals with the nodes in range in its
+update at the end of the step. So the workers update their nodes independently,
+and only have to swap the signals that cross a tile edge before updating their
+shards. Each time step:
+
+    1. every worker updates its nodes, in the order Trial.step does (the first sink,
+       then by id). The packets sent by boundary nodes (those with another tile's node
+       in range) go into the tile's halo buffer in shared memory.
+    2. once every worker has written its buffer, and how many of its sinks have got
+       their data (a barrier), each one reads the buffers of the tiles next to it,
+       propagates the packets sent by its ghost nodes (the other tiles' nodes with one
+       of its own in range) in its shard, and updates the shard. The workers stop
+       together once all of the sinks have their data.
+
+A node hears exactly the signals it would hear in one Medium2.Medium (those of
+every sender in range, with the same airtimes), so every node takes the same
+course. The trial ends at the same time step, with the same MAC statistics, and
+its event log (the workers' events, merged in update order) is the same as with
+the time step loop and Medium2: python EquivalenceCheck.py checks it, and
+python ShardedMedium.py [lot_size] [columns] [rows] [seed] times both on one lot.
+
+Use it through run_trial(...,tiles=(columns,rows)). Each sample of the tree is
+collected once (samples=1), without churn or a cached tree, and the vector
+engines and the event scheduler aren't used. Each tile's buffer holds
+HALO_BYTES of pickled packets per time step. The workers are child processes,
+so a sharded trial can't run inside a multiprocessing.Pool worker (e.g.
+ParallelRunner.py or Benchmark.py).
+
+
+"""
+
+
+from Medium2 import Medium
+from Node import Node
+from EventLog import EventLog, TextEventLog
+from Experiment import make_topology, set_parameters
+from RandomStreams import node_random
+from Topology import NodeRecord
+from collections import namedtuple
+from timeit import default_timer
+import cPickle as pickle
+import multiprocessing
+import traceback
+import Queue
+import random
+import bisect
+import sys
+import os
+
+HALO_BYTES = 1 << 22            # the size of each tile's halo buffer
+SPINS = 2000                    # the times a process checks the barrier before sleeping on it
+
+# the reach of a sender, in the form Medium.get_node_ids_in_range takes
+Reach = namedtuple('Reach',['source_x','source_y','radius'])
+
+
+class MediumShard(Medium):
+    # A Medium for the nodes of one tile. It also knows the ghost nodes (other tiles'
+    # nodes with one of this tile's nodes in range), whose packets come in through
+    # receive_halo, and keeps the packets of its boundary nodes in the outbox.
+    def __init__(self,phy=None):
+        Medium.__init__(self,phy)
+        self.ghosts = {}                # node_id -> node record, for the ghost nodes
+        self.boundary_ids = set()       # the tile's nodes with another tile's node in range
+        self.outbox = []                # the packets the boundary nodes sent this time step
+        self.halo_signals = 0           # the signals (and their airtime) propagated for ghost nodes,
+        self.halo_airtime = 0           # which their own tiles count
+
+    def register_ghosts(self,nodes):
+        for node in nodes:
+            self.ghosts[node.id] = {'id':node.id,'x':node.x,'y':node.y,'radius':node.radius}
+
+    def get_node_by_id(self,node_id):
+        if node_id in self.ghosts:
+            return self.ghosts[node_id]
+        return Medium.get_node_by_id(self,node_id)
+
+    def propagate(self,packet):
+        Medium.propagate(self,packet)
+        if packet.sender_id in self.boundary_ids:
+            self.outbox.append(packet)
+
+    def receive_halo(self,packets):
+        # propagate the packets the ghost nodes sent this time step (the rest are out of range)
+        for packet in packets:
+            if packet.sender_id in self.ghosts:
+                airtime = self.airtime
+                Medium.propagate(self,packet)
+                self.halo_signals += 1
+                self.halo_airtime += self.airtime - airtime
+
+
+class Barrier:
+    # A reusable barrier for processes (Python 2's multiprocessing doesn't have one). The time
+    # steps are short, so with a core for every process, a process spins on the generation
+    # count for a while before it sleeps on the condition. With fewer cores, spinning would
+    # only hold up the processes it's waiting for, so it sleeps straight away.
+    def __init__(self,parties,spins=None):
+        self.parties = parties
+        if spins is None:
+            spins = SPINS if multiprocessing.cpu_count() > parties else 0
+        self.spins = spins
+        self.condition = multiprocessing.Condition()
+        self.count = multiprocessing.RawValue('l',0)
+        self.generation = multiprocessing.RawValue('l',0)
+
+    def wait(self):
+        with self.condition:
+            generation = self.generation.value
+            self.count.value += 1
+            if self.count.value == self.parties:
+                self.count.value = 0
+                self.generation.value = generation + 1
+                self.condition.notify_all()
+                return
+        for spin in xrange(self.spins):
+            if self.generation.value != generation:
+                return
+        with self.condition:
+            while self.generation.value == generation:
+                self.condition.wait()
+
+
+class Halo:
+    # The shared memory the workers swap their boundary packets through, and report in. There are
+    # two sets of it, used on alternate time steps: a worker writes the next time step's set while
+    # the others may still be reading this one's, so one barrier per time step is enough.
+    def __init__(self,tiles,halo_bytes=HALO_BYTES):
+        self.halo_bytes = halo_bytes
+        self.buffers = [[multiprocessing.RawArray('c',halo_bytes) for tile in range(tiles)] for parity in range(2)]
+        self.lengths = [multiprocessing.RawArray('l',tiles) for parity in range(2)]    # the bytes in each buffer
+        self.done = [multiprocessing.RawArray('l',tiles) for parity in range(2)]       # the sinks in each tile that have their data
+        self.failed = [multiprocessing.RawArray('l',tiles) for parity in range(2)]     # has the tile's worker failed?
+        self.barrier = Barrier(tiles)
+
+    def write(self,time,tile,packets):
+        data = pickle.dumps(packets,pickle.HIGHEST_PROTOCOL) if packets else ''
+        if len(data) > self.halo_bytes:
+            raise Exception('the halo buffer is too small: ' + str(len(data)) + ' bytes for ' + str(len(packets)) + ' packets')
+        self.buffers[time % 2][tile][0:len(data)] = data
+        self.lengths[time % 2][tile] = len(data)
+
+    def read(self,time,tile):
+        length = self.lengths[time % 2][tile]
+        if not length:
+            return []
+        return pickle.loads(self.buffers[time % 2][tile][0:length])
+
+    def report(self,time,tile,done,failed):
+        self.done[time % 2][tile] = done
+        self.failed[time % 2][tile] = failed
+
+    def outcome(self,time,sinks,max_steps=None):
+        # how the trial ends after a time step (once every worker has reported), or None to go on.
+        # Every worker comes to the same answer, from the same reports.
+        if any(self.failed[time % 2]):
+            return 'failed'
+        elif sum(self.done[time % 2]) == sinks:
+            return 'finished'
+        elif max_steps is not None and time >= max_steps:
+            return 'given up'
+        return None
+
+
+class ShardEventLog(EventLog):
+    # keeps a tile's events, with the update rank of the node that logged each one, for the parent to merge
+    def __init__(self):
+        EventLog.__init__(self)
+        self.rank = None            # the rank of the node being updated (see Tile.rank)
+        self.records = []           # (time,rank,label,event)
+
+    def log(self,node_id,event):
+        self.records.append((self.time,self.rank,node_id,event))
+
+
+def tile_grid(topology,columns,rows):
+    # the tile of each node: columns x rows tiles over the bounding box of the nodes
+    (min_x,max_x,min_y,max_y) = (min(topology.x),max(topology.x),min(topology.y),max(topology.y))
+    (width,height) = (max(max_x - min_x,1e-9),max(max_y - min_y,1e-9))
+    owner = []
+    for node_id in range(len(topology)):
+        column = min(int((topology.x[node_id] - min_x) / width * columns),columns - 1)
+        row = min(int((topology.y[node_id] - min_y) / height * rows),rows - 1)
+        owner.append(row * columns + column)
+    return owner
+
+
+class Tile:
+    # one worker's part of a sharded trial: the nodes in its tile and their MediumShard.
+    def __init__(self,index,owner,topology,settings):
+        self.index = index
+        self.topology = topology
+        self.settings = settings
+        self.event_log = ShardEventLog()
+        radius = settings['radius']
+        own_ids = [node_id for node_id in range(len(topology)) if owner[node_id] == index]
+        own = set(own_ids)
+
+        # find the boundary and ghost nodes among the nodes within one radius of the tile
+        nearby = []
+        if own_ids:
+            xs = [topology.x[node_id] for node_id in own_ids]
+            ys = [topology.y[node_id] for node_id in own_ids]
+            (min_x,max_x,min_y,max_y) = (min(xs) - radius,max(xs) + radius,min(ys) - radius,max(ys) + radius)
+            nearby = [node_id for node_id in range(len(topology)) if node_id not in own and
+                      min_x <= topology.x[node_id] <= max_x and min_y <= topology.y[node_id] <= max_y]
+        records = dict((node_id,NodeRecord(node_id,topology.x[node_id],topology.y[node_id],radius))
+                       for node_id in own_ids + nearby)
+        region = Medium()
+        region.connect_to_the_nodes([records[node_id] for node_id in own_ids + nearby])
+        self.medium = MediumShard(settings['phy'])
+        self.medium.connect_to_the_nodes([records[node_id] for node_id in own_ids])
+        ghosts = []
+        self.neighbors = set()          # the tiles whose halo buffers have packets for this one
+        for node_id in own_ids + nearby:
+            reached = region.get_node_ids_in_range(Reach(topology.x[node_id],topology.y[node_id],radius))
+            if node_id in own:
+                if any(other not in own for other in reached):
+                    self.medium.boundary_ids.add(node_id)
+            elif any(other in own for other in reached):
+                ghosts.append(records[node_id])
+                self.neighbors.add(owner[node_id])
+        self.medium.register_ghosts(ghosts)
+        self.neighbors = sorted(self.neighbors)
+
+        # the nodes, other than the first sink, in update order (by id), as in Trial
+        self.nodes = []
+        self.node_ids = []
+        self.sink = None
+        self.sink_ids = [node_id for node_id in topology.sinks if node_id in own]
+        sinks = [self.create_node(node_id) for node_id in self.sink_ids]
+        if topology.sinks[0] in own:
+            self.sink = sinks[0]
+            self.nodes.remove(self.sink)
+            self.node_ids.remove(self.sink.id)
+        self.lazy_nodes = settings['lazy_nodes']
+        if not self.lazy_nodes:
+            for node_id in own_ids:
+                if node_id not in topology.sinks:
+                    self.create_node(node_id)
+        for sink in sinks:
+            sink.set_as_sink()
+        self.time = 0
+        self.done_sinks = set()
+
+    def create_node(self,node_id):
+        # as Trial.create_node
+        settings = self.settings
+        (x,y) = self.topology.position(node_id)
+        node = Node(x,y,node_id,self.topology.label(node_id))
+        if node_id not in self.topology.sinks:
+            node.set_event_log(self.event_log)
+        set_parameters(node,settings['radius'],settings['p'],settings['contention_window'],settings['channels'],
+                       settings['concurrent_grow'],settings['grow_quiet_factor'])
+        if settings['policies']:
+            node.network_interface.set_policies(settings['policies'])
+        node.network_interface.set_random(node_random(settings['seed'],node.label))
+        node.connect_to_the_medium(self.medium)
+        index = bisect.bisect(self.node_ids,node_id)
+        self.node_ids.insert(index,node_id)
+        self.nodes.insert(index,node)
+        return node
+
+    def rank(self,node):
+        # where the node comes in the time step loop's update order (the first sink first)
+        return -1 if node is self.sink else node.id
+
+    def update_nodes(self):
+        # the first half of a time step: update the nodes. returns the boundary nodes' packets.
+        self.time += 1
+        self.event_log.set_time(self.time)
+        for node in ([self.sink] if self.sink else []) + self.nodes:
+            self.event_log.rank = self.rank(node)
+            if node.update() and node.i_am_the_data_sink:
+                self.done_sinks.add(node.id)
+        packets = self.medium.outbox
+        self.medium.outbox = []
+        return packets
+
+    def update_medium(self,packets):
+        # the second half: take in the ghost nodes' packets, and update the shard
+        self.medium.receive_halo(packets)
+        self.medium.update()
+        if self.lazy_nodes:
+            # make the nodes that the shard is delivering their first packet to (as Trial.create_receiving_nodes)
+            for node_id in self.medium.get_receiving_node_ids():
+                index = bisect.bisect_left(self.node_ids,node_id)
+                if index == len(self.node_ids) or self.node_ids[index] != node_id:
+                    if self.sink is None or node_id != self.sink.id:
+                        self.create_node(node_id)
+
+    def results(self):
+        nodes = ([self.sink] if self.sink else []) + self.nodes
+        return {'events':self.event_log.records,
+                'ids_received':sum(node.ids_received() for node in nodes if node.i_am_the_data_sink),
+                'node_stats':dict((node.label,node.network_interface.stats(self.time)) for node in nodes),
+                'transmissions':sum(node.network_interface.transmissions for node in nodes),
+                'signals':self.medium.signal_id_counter - self.medium.halo_signals,
+                'airtime':self.medium.airtime - self.medium.halo_airtime,
+                'collisions':self.medium.collision_count,
+                'ghosts':len(self.medium.ghosts),
+                'nodes':len(nodes)}
+
+
+def run_tile(index,owner,topology,settings,halo,results,max_steps=None):
+    # A worker: simulate one tile in lockstep with the others, until the sinks have the data.
+    # A worker that fails keeps reporting (and going through the barrier) until the others
+    # have seen it, so that none of them is left waiting.
+    tile = None
+    error = None
+    try:
+        tile = Tile(index,owner,topology,settings)
+    except Exception:
+        error = traceback.format_exc()
+    time = 0
+    while True:
+        time += 1
+        if error is None:
+            try:
+                halo.write(time,index,tile.update_nodes())
+            except Exception:
+                error = traceback.format_exc()
+        if error is not None:
+            halo.write(time,index,[])
+        halo.report(time,index,len(tile.done_sinks) if tile else 0,error is not None)
+        halo.barrier.wait()
+        if error is None:
+            try:
+                tile.update_medium([packet for neighbor in tile.neighbors for packet in halo.read(time,neighbor)])
+            except Exception:
+                error = traceback.format_exc()
+        outcome = halo.outcome(time,len(topology.sinks),max_steps)
+        if outcome:
+            break
+    results.put((index,time,outcome,tile.results() if error is None else None,error))
+
+
+class ShardedTrial:
+    # A trial (see Experiment.Trial) run on columns x rows worker processes, one per tile.
+    def __init__(self,event_log,tiles=(2,2),occupancy=.62,radius=2,p=0.05,contention_window=3,lot_size=10,seed=None,
+                 topology=None,lazy_nodes=True,phy=None,channels=1,concurrent_grow=False,policies=None,
+                 grow_quiet_factor=None,halo_bytes=HALO_BYTES):
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+        self.event_log = event_log
+        self.topology = make_topology(topology,seed,lot_size,occupancy)
+        event_log.start_trial(self.topology.node_count())
+        (self.columns,self.rows) = tiles
+        self.owner = tile_grid(self.topology,self.columns,self.rows)
+        self.halo_bytes = halo_bytes
+        self.settings = {'radius':radius,'p':p,'contention_window':contention_window,'channels':channels,
+                         'concurrent_grow':concurrent_grow,'grow_quiet_factor':grow_quiet_factor,'policies':policies,
+                         'seed':seed,'phy':phy,'lazy_nodes':lazy_nodes}
+        self.time = 0
+        self.finished = False
+        self.tile_results = []
+
+    def run(self,max_steps=None):
+        # simulate until the sinks have the data, and return the number of time steps (as Trial.run)
+        tiles = self.columns * self.rows
+        halo = Halo(tiles,self.halo_bytes)
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=run_tile,
+                                           args=(index,self.owner,self.topology,self.settings,halo,results,max_steps))
+                   for index in range(tiles)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        collected = []
+        try:
+            while len(collected) < tiles:
+                try:
+                    collected.append(results.get(timeout=1))
+                except Queue.Empty:
+                    # a worker that died without reporting leaves the others waiting at the barrier
+                    if any(worker.exitcode for worker in workers):
+                        raise Exception('a tile worker died (exit code ' + str([worker.exitcode for worker in workers]) + ')')
+        finally:
+            for worker in workers:
+                if len(collected) < tiles:
+                    worker.terminate()
+                worker.join()
+        collected.sort()
+        errors = [error for (index,time,outcome,result,error) in collected if error]
+        if errors:
+            raise Exception('a tile failed:\n' + errors[0])
+        (index,self.time,outcome,result,error) = collected[0]
+        self.tile_results = [result for (index,time,outcome,result,error) in collected]
+        if outcome == 'given up':
+            raise Exception("the trial didn't finish within " + str(max_steps) + " time steps")
+        self.finished = True
+        self.write_events()
+        self.event_log.end_trial(self.time,self.ids_received())
+        return self.time
+
+    def write_events(self):
+        # log the workers' events in the time step loop's order: by time step, then update rank
+        # (the sort is stable, and each node's events come from one worker in the order it logged them)
+        records = []
+        for result in self.tile_results:
+            records.extend(result['events'])
+        records.sort(key=lambda record: (record[0],record[1]))
+        for (time,rank,label,event) in records:
+            self.event_log.set_time(time)
+            self.event_log.log(label,event)
+        self.event_log.set_time(self.time)
+
+    def total(self,name):
+        return sum(result[name] for result in self.tile_results)
+
+    def ids_received(self):
+        # the number of node ids that reached the sinks
+        return self.total('ids_received')
+
+    def transmissions(self):
+        return self.total('transmissions')
+
+    def node_stats(self):
+        # each node's MAC statistics, by label (see Trial.node_stats)
+        stats = {}
+        for result in self.tile_results:
+            stats.update(result['node_stats'])
+        return stats
+
+
+def compare(lot_size=20,tiles=(2,2),seed=0):
+    # run one lot with the time step loop and Medium2, and sharded, and compare them
+    from Experiment import Trial
+    start = default_timer()
+    trial = Trial(TextEventLog(os.devnull),seed=seed,lot_size=lot_size)
+    steps = trial.run()
+    single = (steps,trial.ids_received(),trial.transmissions(),trial.medium.collision_count,trial.node_stats())
+    middle = default_timer()
+    sharded_trial = ShardedTrial(TextEventLog(os.devnull),tiles,seed=seed,lot_size=lot_size)
+    steps = sharded_trial.run()
+    sharded = (steps,sharded_trial.ids_received(),sharded_trial.transmissions(),sharded_trial.total('collisions'),
+               sharded_trial.node_stats())
+    end = default_timer()
+    print 'Medium2:', single[:4], round(middle - start,2), 'seconds'
+    print 'sharded ' + str(tiles[0]) + 'x' + str(tiles[1]) + ':', sharded[:4], round(end - middle,2), 'seconds'
+    return single == sharded
+
+
+if __name__ == '__main__':
+    lot_size = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    columns = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    rows = int(sys.argv[3]) if len(sys.argv) > 3 else columns
+    seed = int(sys.argv[4]) if len(sys.argv) > 4 else 0
+    if not compare(lot_size,(columns,rows),seed):
+        print 'MISMATCH'
+        sys.exit(1)
+    print 'OK'
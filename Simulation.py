@@ -7,107 +7,43 @@ David Beatrice
 11/14/2015
 
 
-This script drives the simulation of the in-network data aggregation.
+This script drives the simulation of the in-network data aggregation,
+drawing it with pygame. To run the same experiment without a display,
+run Experiment.py instead.
 
 
 """
 
 
-from MultipleAccess import MultipleAccess
-from Medium2 import Medium
-from Node import Node, Edges
-import sys, pygame
-import random
-import time
+from Experiment import run_experiment
+from Renderer import Renderer
+import Topology
 
 
-# colors for pygame
-BLACK =  (  0,   0,   0)
-WHITE =  (255, 255, 255)
-BLUE =   (  0,   0, 255)
-GREEN =  (  0, 255,   0)
-RED =    (255,   0,   0)
-YELLOW = (255, 255,   0)
+# use the NumPy medium engine (VectorMedium.py) in place of Medium2.Medium
+use_vector_medium = False
 
-def render_building():
-    pygame.draw.rect(screen,BLUE,(850,250,100,200),0)
+# skip the time steps in which nothing happens (EventScheduler.py) instead of updating everything on every time step
+use_event_scheduler = False
 
-# Initialize the game engine
-pygame.init()
-size = [1000,600]
-screen = pygame.display.set_mode(size)
+# the lot: lot_size x lot_size spaces, each occupied with probability occupancy
+lot_size = 10
+occupancy = .62
+
+# or lay the lot out with a generator from Topology.py, e.g.
+# topology = lambda stream: Topology.multiple_lots(stream,2,lot_size,occupancy)
+topology = None
+
+# draw every N time steps
+render_every = 1
 
 # designate an output file
 output_file = 'output.txt'
-# clear the file
-open(output_file,'w').close()
-
-for each in range(30):
-    print each
-    
-    # create nodes
-    nodes = []
-    for i in range(0,10):
-        for j in range(0,10):
-            if random.random() <= .62:
-                node_id = str(i) + '_' + str(j)
-                node = Node(i,j,node_id)
-                node.set_output_file(output_file) # give it the output file 
-                nodes.append(node)
-
-    # mark the start of one simulation
-    with open(output_file,'a') as f:
-        f.write('#'+str(len(nodes))+'\n')
-    
-    # create a data sink
-    sink = Node(10,5,'10_5')
-    
-    # create the medium
-    medium = Medium()
-
-    # point the medium to the nodes
-    medium.connect_to_the_nodes(nodes + [sink])
-    
-    # point the nodes to the medium
-    for node in nodes:
-        node.connect_to_the_medium(medium)
-
-    # point the sink to the medium
-    sink.connect_to_the_medium(medium)
-    # set as sink node (it initiates the process)
-    sink.set_as_sink()
-
-    # record and render edges
-    edges = Edges(screen)
-
-    # simulation loop
-    while True:
-        
-        edges.reset()
-        # pygame inputs
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                sys.exit()
-                
-        # parking lot node updates
-        output = sink.update()
-        for node in nodes:
-            node.update()
-            edges.record_edge(node)
-        medium.update()
-        
-        # visual updates 
-        screen.fill(BLACK)
-        render_building()
-        sink.render(screen)
-        for node in nodes:
-            node.render(screen)
-        edges.render(screen)
-            
-        pygame.display.update()
-
-        if output:
-            break
-    
-pygame.quit()
 
+renderer = Renderer(render_every)
+
+# every node is made up front, so that the whole lot is drawn from the start
+run_experiment(30,output_file,use_vector_medium,use_event_scheduler,renderer,
+               occupancy=occupancy,lot_size=lot_size,topology=topology,lazy_nodes=False)
+
+renderer.quit()
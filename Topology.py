@@ -0,0 +1,130 @@
+"""
+
+Topology Class
+--------------
+
+Where the nodes (cars) and the data sinks of a trial are. Positions are kept in
+arrays, and nodes are identified by integers (their index in the arrays), with a
+string label for each one (e.g. '3_4') that the event logs use. Node objects
+aren't made here: Experiment.Trial makes them when they're first needed, so that
+very large lots (100k nodes) fit in memory and start quickly.
+
+Generators, each taking a random stream (see RandomStreams.py):
+    grid_lot        a lot_size x lot_size lot, each space occupied with the given
+                    probability, with a sink beside the middle of its right-hand edge
+                    (the lot that Experiment.py has always used)
+    poisson_lot     a width x height lot with a Poisson-distributed number of cars
+                    (density per space), at uniformly random positions
+    multiple_lots   lots side by side, each with its own sink
+and add_sink() adds a sink anywhere.
+
+
+"""
+
+
+from collections import namedtuple
+from array import array
+import math
+
+# what the medium needs to know about a node (see Medium2.Medium.register_nodes)
+NodeRecord = namedtuple('NodeRecord',['id','x','y','radius'])
+
+
+class Topology:
+    def __init__(self):
+        self.x = array('d')
+        self.y = array('d')
+        self.labels = []                # node id -> label
+        self.sinks = []                 # the ids of the data sinks, the first one first
+
+    def __len__(self):
+        return len(self.labels)
+
+    def add_node(self,x,y,label=None):
+        # add a node. returns its id.
+        node_id = len(self.labels)
+        self.x.append(x)
+        self.y.append(y)
+        self.labels.append(label if label is not None else 'n' + str(node_id))
+        return node_id
+
+    def add_sink(self,x,y,label=None):
+        node_id = self.add_node(x,y,label)
+        self.sinks.append(node_id)
+        return node_id
+
+    def label(self,node_id):
+        return self.labels[node_id]
+
+    def position(self,node_id):
+        return (self.x[node_id],self.y[node_id])
+
+    def node_count(self):
+        # the number of nodes, not counting the sinks
+        return len(self.labels) - len(self.sinks)
+
+    def node_ids(self):
+        # the ids of the nodes that aren't sinks
+        sinks = set(self.sinks)
+        return [node_id for node_id in range(len(self.labels)) if node_id not in sinks]
+
+    def records(self,radius=2):
+        # the nodes (and sinks), as the medium registers them
+        return [NodeRecord(node_id,self.x[node_id],self.y[node_id],radius) for node_id in range(len(self.labels))]
+
+
+def grid_label(x,y):
+    return str(x) + '_' + str(y)
+
+
+def grid_lot(stream,lot_size=10,occupancy=.62,origin=(0,0),topology=None,sink=True):
+    # fill a lot_size x lot_size lot, each space occupied with the given probability
+    if topology is None:
+        topology = Topology()
+    (x0,y0) = origin
+    for i in range(0,lot_size):
+        for j in range(0,lot_size):
+            if stream.random() <= occupancy:
+                topology.add_node(x0 + i,y0 + j,grid_label(x0 + i,y0 + j))
+    if sink:
+        # a data sink beside the middle of the lot's right-hand edge
+        add_sink(topology,x0 + lot_size,y0 + lot_size // 2)
+    return topology
+
+
+def poisson(stream,mean):
+    # a Poisson-distributed random number (Knuth's method, for small means)
+    limit = math.exp(-mean)
+    count = 0
+    product = stream.random()
+    while product > limit:
+        count += 1
+        product *= stream.random()
+    return count
+
+
+def poisson_lot(stream,width=10,height=10,density=.62,origin=(0,0),topology=None,sink=True):
+    # a Poisson number of cars in each space (density per space on average), each
+    # at a uniformly random position in its space
+    if topology is None:
+        topology = Topology()
+    (x0,y0) = origin
+    for i in range(0,width):
+        for j in range(0,height):
+            for each in range(poisson(stream,density)):
+                topology.add_node(x0 + i + stream.random(),y0 + j + stream.random())
+    if sink:
+        add_sink(topology,x0 + width,y0 + height // 2)
+    return topology
+
+
+def multiple_lots(stream,lots=2,lot_size=10,occupancy=.62,spacing=2):
+    # lots side by side (along y), spacing spaces apart, each with its own sink
+    topology = Topology()
+    for lot in range(lots):
+        grid_lot(stream,lot_size,occupancy,(0,lot * (lot_size + spacing)),topology)
+    return topology
+
+
+def add_sink(topology,x,y):
+    return topology.add_sink(x,y,grid_label(x,y))
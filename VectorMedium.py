@@ -0,0 +1,324 @@
+'''
+The VectorMedium Class
+----------------------
+
+A drop-in replacement for Medium2.Medium that keeps its tables in NumPy arrays.
+
+nodes
+    node_x, node_y, node_radius   (one entry per registered node)
+    grid                          (cell -> the nodes in it, as in Medium2)
+
+signals
+    signal_x, signal_y, signal_radius, signal_time, signal_ids, signal_channel, and a list of packets
+    (one entry per signal in the medium, in the order they were propagated)
+
+signals_to_nodes
+    pair_signal     the signal row of each pair
+    pair_node       the node column of each pair
+    pair_collision  whether the pair was ever collided
+
+The pairs are kept sparse: a new signal is only tested against the nodes in the
+grid cells around it, and each time step costs in proportion to the signals in
+flight and the nodes they reach, not to the number of nodes on the lot.
+
+Each update() finds the nodes in range of the new signals, marks collisions and
+counts down the propagation timers as batched array operations. It then works out
+what every node in range of a signal would hear on each channel in use, so that
+listen() is a single lookup. Signals on different channels don't collide (see Medium2.py).
+
+The behavior is the same as Medium2.Medium, step for step: a signal propagated
+during a time step is only heard by the nodes after the next update(). It has
+the same public methods too; the record lookups (get_signal_by_id etc.) build
+Medium2-style dicts from the arrays on demand, so they're for debugging rather
+than for the hot path.
+
+Medium2 handles each signal and pair in Python, so it's the faster of the two
+while few signals are in flight at once (e.g. with the protocol's low traffic).
+VectorMedium pays off when many signals are in flight in each time step, e.g.
+dozens of broadcasts per step on a lot with thousands of nodes (python
+Benchmark.py --benchmark medium compares them).
+
+'''
+import math
+import itertools
+import numpy as np
+from Phy import Phy
+
+BUSY = -1           # what a node hears (see listen): a row of the signal arrays, or BUSY
+
+
+class VectorMedium:
+    def __init__(self,phy=None):
+        self.phy = phy or Phy()                             # times the signals (see Phy.py)
+        self.airtime = 0                                    # the time steps of airtime of all the signals propagated so far
+        # nodes
+        self.node_ids = []
+        self.node_index = {}                                # node_id -> column in the node arrays
+        self.node_x = np.zeros(0)
+        self.node_y = np.zeros(0)
+        self.node_radius = np.zeros(0)
+        self.grid = {}                                      # spatial index: (cell_x,cell_y) -> the columns of the nodes in that cell
+        self.grid_cell_size = 1                             # the width of a grid cell (the largest node radius)
+        # signals that have reached the nodes
+        self.signal_ids = np.zeros(0,dtype=np.int64)
+        self.signal_x = np.zeros(0)
+        self.signal_y = np.zeros(0)
+        self.signal_radius = np.zeros(0)
+        self.signal_time = np.zeros(0,dtype=np.int64)
+        self.signal_channel = np.zeros(0,dtype=np.int64)
+        self.packets = []
+        # signal/node pairs: a signal row and a node column each
+        self.pair_signal = np.zeros(0,dtype=np.int64)
+        self.pair_node = np.zeros(0,dtype=np.int64)
+        self.pair_collision = np.zeros(0,dtype=bool)
+        # signals propagated since the last update (they haven't reached anyone yet)
+        self.new_signals = []
+        self.signal_id_counter = 0
+        self.collision_count = 0                            # the number of signal/node pairs that have collided so far
+        # what each node in range of a signal hears on each channel in use until the next update:
+        # channel -> {node column: signal row or BUSY}. The other nodes hear 'CLEAR'.
+        self.heard = {}
+        self.receiving_node_ids = []
+
+    def connect_to_the_nodes(self,nodes):
+        self.register_nodes(nodes)      # create node records
+
+    def register_nodes(self,nodes):
+        # initially register all nodes.
+        # (new nodes, e.g. cars that arrive during a trial, aren't reached by the signals in the medium yet)
+        first = len(self.node_ids)
+        for node in nodes:
+            if node.id in self.node_index:
+                raise Exception("Zero or multiple nodes have that ID")
+            self.node_index[node.id] = len(self.node_ids)
+            self.node_ids.append(node.id)
+        self.node_x = np.append(self.node_x,[float(node.x) for node in nodes])
+        self.node_y = np.append(self.node_y,[float(node.y) for node in nodes])
+        self.node_radius = np.append(self.node_radius,[float(node.radius) for node in nodes])
+        if len(self.node_ids) and self.node_radius[first:].max() > self.grid_cell_size:
+            self.build_grid()
+        else:
+            for column in range(first,len(self.node_ids)):
+                self.grid.setdefault(self.grid_cell(self.node_x[column],self.node_y[column]),[]).append(column)
+
+    def unregister_nodes(self,node_ids):
+        # forget nodes (e.g. cars that left the lot): they're moved out of reach of any new signal.
+        for node_id in node_ids:
+            column = self.node_index[node_id]
+            cell = self.grid_cell(self.node_x[column],self.node_y[column])
+            self.grid[cell].remove(column)
+            if not self.grid[cell]:
+                del self.grid[cell]
+            self.node_x[column] = np.inf
+            self.node_y[column] = np.inf
+
+    def grid_cell(self,x,y):
+        # the grid cell containing a point
+        return (int(math.floor(x / self.grid_cell_size)),int(math.floor(y / self.grid_cell_size)))
+
+    def build_grid(self):
+        # bucket the node columns by position. The cell width is the largest
+        # transmission radius, so a range query only has to visit a few cells.
+        self.grid = {}
+        self.grid_cell_size = max(float(self.node_radius.max()) if len(self.node_ids) else 0,1.0)
+        for column in np.nonzero(np.isfinite(self.node_x))[0].tolist():
+            self.grid.setdefault(self.grid_cell(self.node_x[column],self.node_y[column]),[]).append(column)
+
+    def get_node_columns_near(self,x,y,radius):
+        # the columns of the nodes in the grid cells that a signal's range overlaps
+        if not np.isfinite(x):
+            return []                   # sent by a node that has been unregistered
+        (min_x,min_y) = self.grid_cell(x - radius,y - radius)
+        (max_x,max_y) = self.grid_cell(x + radius,y + radius)
+        columns = []
+        for cell_x in range(min_x,max_x + 1):
+            for cell_y in range(min_y,max_y + 1):
+                columns.extend(self.grid.get((cell_x,cell_y),()))
+        return columns
+
+    def get_node_by_id(self,node_id):
+        if node_id in self.node_index:
+            index = self.node_index[node_id]
+            return {'id':node_id,'x':self.node_x[index],'y':self.node_y[index],'radius':self.node_radius[index]}
+        else:
+            raise Exception("Zero or multiple nodes have that ID")
+
+    def get_signal_by_id(self,signal_id):
+        rows = np.nonzero(self.signal_ids == signal_id)[0]
+        if len(rows) == 1:
+            return self.signal_record(rows[0])
+        for (new_id,x,y,radius,time,channel,packet) in self.new_signals:
+            if new_id == signal_id:
+                return {'id':new_id,'source_x':x,'source_y':y,'radius':radius,'time':time,'channel':channel,'packet':packet}
+        raise Exception("Zero or multiple signals have that ID")
+
+    def get_signal_node_pair_by_both_ids(self,signal_id,node_id):
+        rows = np.nonzero(self.signal_ids == signal_id)[0]
+        if len(rows) == 1 and node_id in self.node_index:
+            pairs = np.nonzero((self.pair_signal == rows[0]) & (self.pair_node == self.node_index[node_id]))[0]
+            if len(pairs):
+                return self.pair_record(pairs[0])
+        return None
+
+    def get_signal_node_pairs_by_node_id(self,node_id):
+        if node_id not in self.node_index:
+            return []
+        return [self.pair_record(pair) for pair in np.nonzero(self.pair_node == self.node_index[node_id])[0]]
+
+    def signal_record(self,row):
+        # a Medium2-style signal record for a row of the signal arrays
+        return {'id':int(self.signal_ids[row]),'source_x':self.signal_x[row],'source_y':self.signal_y[row],
+                'radius':self.signal_radius[row],'time':int(self.signal_time[row]),'channel':int(self.signal_channel[row]),
+                'packet':self.packets[row]}
+
+    def pair_record(self,pair):
+        # a Medium2-style signal/node pair record
+        row = self.pair_signal[pair]
+        return {'signal_id':int(self.signal_ids[row]),'node_id':self.node_ids[self.pair_node[pair]],
+                'collision':bool(self.pair_collision[pair]),'channel':int(self.signal_channel[row])}
+
+    def in_range(self,signal,node):
+        # determine if a signal is in range of a node
+        return (signal['source_x'] - node['x'])**2 + (signal['source_y'] - node['y'])**2 <= signal['radius']**2
+
+    def propagate(self,packet):
+        # propagate a signal accross the medium
+        index = self.node_index.get(packet.sender_id)
+        if index is None:
+            raise Exception("Zero or multiple nodes have that ID")
+        airtime = self.phy.airtime(packet)
+        self.new_signals.append((self.signal_id_counter,
+                                 self.node_x[index],
+                                 self.node_y[index],
+                                 self.node_radius[index],
+                                 airtime,
+                                 packet.channel,
+                                 packet))
+        self.airtime += airtime
+        self.signal_id_counter += 1
+
+    def create_signal_node_pairs(self):
+        # append the new signals' rows, and a pair for each node in range of one.
+        if not self.new_signals:
+            return
+        (ids,x,y,radius,time,channels,packets) = zip(*self.new_signals)
+        x = np.array(x)
+        y = np.array(y)
+        radius = np.array(radius)
+        # only the nodes in the grid cells around a signal can be in its range
+        near = [self.get_node_columns_near(*signal[1:4]) for signal in self.new_signals]
+        signals = np.repeat(np.arange(len(near)),[len(columns) for columns in near])
+        columns = np.fromiter(itertools.chain.from_iterable(near),dtype=np.int64,count=len(signals))
+        reach = (x[signals] - self.node_x[columns])**2 + (y[signals] - self.node_y[columns])**2 <= radius[signals]**2
+        self.pair_signal = np.append(self.pair_signal,signals[reach] + len(self.packets))
+        self.pair_node = np.append(self.pair_node,columns[reach])
+        self.pair_collision = np.append(self.pair_collision,np.zeros(int(reach.sum()),dtype=bool))
+        self.signal_ids = np.append(self.signal_ids,ids)
+        self.signal_x = np.append(self.signal_x,x)
+        self.signal_y = np.append(self.signal_y,y)
+        self.signal_radius = np.append(self.signal_radius,radius)
+        self.signal_time = np.append(self.signal_time,time)
+        self.signal_channel = np.append(self.signal_channel,channels)
+        self.packets.extend(packets)
+        self.new_signals = []
+
+    def pair_keys(self):
+        # a key per pair for its node and its signal's channel, ordered by channel and then node,
+        # and how many pairs share each pair's key (the signals on its channel in range of its node).
+        keys = self.signal_channel[self.pair_signal] * len(self.node_ids) + self.pair_node
+        (unique,inverse,counts) = np.unique(keys,return_inverse=True,return_counts=True)
+        return (keys,counts[inverse])
+
+    def record_collisions(self):
+        # every pair at a node that has more than one signal on its channel in range has collided.
+        if not len(self.pair_node):
+            return
+        collided = self.pair_keys()[1] > 1
+        self.collision_count += int((collided & ~self.pair_collision).sum())
+        self.pair_collision |= collided
+
+    def update_propagation_counters(self):
+        # count down the timers and drop the signals that have finished propagating (and their pairs).
+        self.signal_time -= 1
+        alive = self.signal_time > 0
+        if not alive.all():
+            self.signal_ids = self.signal_ids[alive]
+            self.signal_x = self.signal_x[alive]
+            self.signal_y = self.signal_y[alive]
+            self.signal_radius = self.signal_radius[alive]
+            self.signal_time = self.signal_time[alive]
+            self.signal_channel = self.signal_channel[alive]
+            self.packets = [packet for (packet,keep) in zip(self.packets,alive) if keep]
+            kept = alive[self.pair_signal]
+            self.pair_signal = (np.cumsum(alive) - 1)[self.pair_signal[kept]]
+            self.pair_node = self.pair_node[kept]
+            self.pair_collision = self.pair_collision[kept]
+
+    def update_heard(self):
+        # work out what each node in range of a signal hears on each channel until the next update
+        # (see Medium2.Medium.listen): the packet of a lone signal that's done propagating and never
+        # collided there, or 'BUSY'.
+        self.heard = dict((channel,{}) for channel in np.unique(self.signal_channel).tolist())
+        self.receiving_node_ids = []
+        if not len(self.pair_node):
+            return
+        (keys,counts) = self.pair_keys()
+        clean = (counts == 1) & ~self.pair_collision & (self.signal_time[self.pair_signal] == 1)
+        channels = self.signal_channel[self.pair_signal].tolist()
+        rows = np.where(clean,self.pair_signal,BUSY).tolist()
+        for (channel,column,row) in zip(channels,self.pair_node.tolist(),rows):
+            self.heard[channel][column] = row
+        order = np.argsort(keys[clean],kind='mergesort')
+        self.receiving_node_ids = [self.node_ids[column] for column in self.pair_node[clean][order].tolist()]
+
+    def update(self):
+        if not self.new_signals and not self.packets:
+            # nothing in the medium: every node already hears 'CLEAR'.
+            return
+        self.create_signal_node_pairs()
+        self.record_collisions()
+        self.update_propagation_counters()
+        self.update_heard()
+
+    def listen(self,node_id,channel=0):
+        index = self.node_index.get(node_id)
+        if index is None or channel not in self.heard:
+            # like Medium2.Medium: no signal reaches an unregistered node, or a channel with no signals.
+            return 'CLEAR'
+        row = self.heard[channel].get(index)
+        if row is None:
+            return 'CLEAR'
+        elif row == BUSY:
+            return 'BUSY'
+        else:
+            return self.packets[row]
+
+    def is_idle(self):
+        # no signals in the medium, so update() has nothing to do.
+        return not self.new_signals and not self.packets
+
+    def signals_in_flight(self):
+        return len(self.packets) + len(self.new_signals)
+
+    def pair_count(self):
+        # the number of signal/node pairs
+        return len(self.pair_node)
+
+    def get_receiving_node_ids(self):
+        # the ids of the nodes whose next listen() returns a packet.
+        return self.receiving_node_ids
+
+    def print_signal_node_pairs(self):
+        # for debugging
+        for pair in range(len(self.pair_node)):
+            print self.pair_record(pair)
+
+    def print_nodes(self):
+        # for debugging
+        for node_id in self.node_ids:
+            print self.get_node_by_id(node_id)
+
+    def print_signals(self):
+        # for debugging
+        for row in range(len(self.packets)):
+            print self.signal_record(row)
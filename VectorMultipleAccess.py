@@ -0,0 +1,178 @@
+'''
+The VectorMultipleAccess Class
+------------------------------
+
+A batched p-persistant CSMA engine for all the nodes of a trial. Each node still
+has a network_interface with the MultipleAccess methods (send_message,
+receive_message, ...), but it's a thin view (MultipleAccessView) onto one
+column of the engine's NumPy arrays:
+
+    state               the state of each FSM (QUEUE_IS_EMPTY, OUTGOING_MESSAGE_PENDING, WAITING_FOR_ACK)
+    backoff_counter     the CSMA backoff counters
+    ack_wait_counter    the ACK wait counters
+    p, contention_window, ack_wait
+    clock               the time steps each node has been updated for (see MultipleAccess.stats)
+    queued              is anything waiting in either lane?
+    expecting           are ACKs expected?
+    has_ack             is there an ACK in the holder?
+    active              was Node.update called on the node this time step?
+
+Node.update only marks the node active; the simulation loop then calls the
+engine's update() once per time step, before the medium's. Most nodes are just
+counting down a counter, so update() does the counting and the checks for
+every node at once. Only the nodes with something to do (a packet arriving,
+a channel to sense, a packet to send, an ACK to check, a timeout) go through
+the per-node MultipleAccess code.
+
+Each node goes through the same FSM as before, drawing its random numbers
+from its own stream (see RandomStreams.py), so a trial takes exactly the same
+course as with one MultipleAccess per node. It works with the time step loop
+only: the event scheduler updates nodes one at a time.
+
+'''
+import numpy as np
+from MultipleAccess import MultipleAccess
+
+# the FSM states, as stored in the state array
+STATES = ['QUEUE_IS_EMPTY','OUTGOING_MESSAGE_PENDING','WAITING_FOR_ACK']
+QUEUE_IS_EMPTY = 0
+OUTGOING_MESSAGE_PENDING = 1
+WAITING_FOR_ACK = 2
+
+
+def column(name):
+    # a MultipleAccess attribute that lives in one of the engine's arrays
+    def get(self):
+        return getattr(self._engine,name)[self._index]
+    def set(self,value):
+        getattr(self._engine,name)[self._index] = value
+    return property(get,set)
+
+
+class MultipleAccessView(MultipleAccess,object):
+    # A node's network interface: the MultipleAccess queues and methods, with the
+    # FSM state and counters kept in the engine's arrays.
+    _backoff_counter = column('backoff_counter')
+    _ack_wait_counter = column('ack_wait_counter')
+    _contention_window = column('contention_window')
+    _ack_wait = column('ack_wait')
+    p = column('p')
+    clock = column('clock')
+
+    def __init__(self,engine,index,interface):
+        self._engine = engine
+        self._index = index
+        # take over the node's MultipleAccess object: its queues, limits, counters and parameters.
+        for (name,value) in interface.__dict__.items():
+            setattr(self,name,value)
+        self._sync()
+
+    def _get_state(self):
+        return STATES[self._engine.state[self._index]]
+
+    def _set_state(self,state):
+        self._engine.state[self._index] = STATES.index(state)
+
+    _state = property(_get_state,_set_state)
+
+    def _sync(self):
+        # update the engine's flags after the per-node code has run
+        engine = self._engine
+        engine.queued[self._index] = self._outgoing_message_queued()
+        engine.expecting[self._index] = len(self._expected_acks) > 0
+        engine.has_ack[self._index] = self._incoming_ack is not None
+
+    def send_message(self,message):
+        MultipleAccess.send_message(self,message)
+        self._engine.queued[self._index] = self._outgoing_message_queued()
+
+    def update(self):
+        # the engine updates every active node at once (see VectorMultipleAccess.update).
+        self._engine.active[self._index] = True
+
+    def idle_ticks(self):
+        raise Exception('VectorMultipleAccess works with the time step loop only')
+
+
+class VectorMultipleAccess:
+    def __init__(self,nodes):
+        # give each node a view onto the engine in place of its MultipleAccess object.
+        count = len(nodes)
+        self.state = np.zeros(count,dtype=np.int8)
+        self.backoff_counter = np.zeros(count,dtype=np.int64)
+        self.ack_wait_counter = np.zeros(count,dtype=np.int64)
+        self.contention_window = np.zeros(count,dtype=np.int64)
+        self.ack_wait = np.zeros(count,dtype=np.int64)
+        self.p = np.zeros(count)
+        self.clock = np.zeros(count,dtype=np.int64)
+        self.queued = np.zeros(count,dtype=bool)
+        self.expecting = np.zeros(count,dtype=bool)
+        self.has_ack = np.zeros(count,dtype=bool)
+        self.active = np.zeros(count,dtype=bool)
+        self.views = []
+        self.node_index = {}                                # node_id -> column in the arrays
+        for index,node in enumerate(nodes):
+            view = MultipleAccessView(self,index,node.network_interface)
+            node.network_interface = view
+            self.views.append(view)
+            self.node_index[node.id] = index
+        self.medium = None
+
+    def connect_to_the_medium(self,medium):
+        self.medium = medium
+        for view in self.views:
+            view.connect_to_the_medium(medium)
+
+    def _handle_incoming_packets(self):
+        # only the active nodes that the medium is delivering a packet to have anything to do.
+        for node_id in self.medium.get_receiving_node_ids():
+            index = self.node_index.get(node_id)
+            if index is not None and self.active[index]:
+                view = self.views[index]
+                view._handle_incoming_packets()
+                view._sync()
+
+    def _handle_outgoing_packets(self):
+        # one step of every active node's FSM. The branches are picked before any
+        # of them run, so every node takes the one for the state it started the step in.
+        active = self.active
+        state = self.state
+        empty = active & (state == QUEUE_IS_EMPTY)
+        pending = active & (state == OUTGOING_MESSAGE_PENDING)
+        waiting = active & (state == WAITING_FOR_ACK)
+        due = np.nonzero(pending & (self.backoff_counter == 0))[0]
+        counting = pending & (self.backoff_counter != 0)
+        waiting_on_acks = waiting & self.expecting & (self.ack_wait_counter != 0)
+        checking = np.nonzero(waiting_on_acks & self.has_ack)[0]
+        waiting_on_acks &= ~self.has_ack
+        finished = np.nonzero(waiting & (~self.expecting | (self.ack_wait_counter == 0)))[0]
+
+        # STATE: queue is empty
+        state[empty & self.queued] = OUTGOING_MESSAGE_PENDING
+
+        # STATE: outgoing message pending
+        self.backoff_counter[counting] -= 1                         # keep counting down the backoff counters.
+        for index in due:
+            view = self.views[index]                                # the backoff counter has run out: listen, and
+            view._outgoing_message_pending()                        # send or back off (from the node's own stream).
+            view._sync()
+
+        # STATE: waiting for ACK
+        self.ack_wait_counter[waiting_on_acks] -= 1                 # keep counting down the ACK waits.
+        for index in checking:
+            view = self.views[index]                                # an ACK is in: check it, and count down.
+            view._waiting_for_ack()
+            view._sync()
+        for index in finished:
+            view = self.views[index]                                # all the ACKs are in, or time ran out.
+            view._waiting_for_ack()
+            view._sync()
+
+    def update(self):
+        # update every node that Node.update was called on this time step.
+        if not self.active.any():
+            return
+        self.clock[self.active] += 1
+        self._handle_incoming_packets()
+        self._handle_outgoing_packets()
+        self.active[:] = False